@@ -60,6 +60,10 @@ def _configure_app(app: Flask) -> None:
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)
 
+    # JSON responses: skip per-response key sorting and always serialize compactly
+    app.json.sort_keys = False
+    app.json.compact = True
+
     # OAuth environment
     os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = config.OAUTHLIB_INSECURE_TRANSPORT
 
@@ -172,6 +176,18 @@ def _apply_schema_migrations() -> None:
             ADD COLUMN IF NOT EXISTS repeat_until DATE;
         '''))
         
+        # Composite index for per-user appointment date range queries
+        db.session.execute(db.text('''
+            CREATE INDEX IF NOT EXISTS ix_appt_user_date
+            ON appointment (user_id, date);
+        '''))
+        
+        # Stripe session lookups filtered by status (payment success / webhooks)
+        db.session.execute(db.text('''
+            CREATE INDEX IF NOT EXISTS ix_transactions_session_status
+            ON transactions (stripe_session_id, status);
+        '''))
+        
         db.session.commit()
         logger.info("Database migrations completed successfully")
     except Exception as e:
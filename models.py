@@ -4,14 +4,24 @@ Database models for the AI Activity Planner application.
 This module defines all SQLAlchemy ORM models including User, Activity,
 Appointment, and audit/transaction tracking tables.
 """
+import json
 from datetime import datetime
 
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
 from werkzeug.security import check_password_hash, generate_password_hash
 
 db = SQLAlchemy()
 
+# Subscription tiers
+TIER_FREE = 'free_tier'
+TIER_PAID = 'paid_tier'
+TIER_ADMIN = 'admin'
+# Tiers a user may switch themselves between
+VALID_TIERS = frozenset((TIER_FREE, TIER_PAID))
+PAID_TIERS = frozenset((TIER_PAID, TIER_ADMIN))
+
 
 class User(UserMixin, db.Model):
     """User account model with authentication and profile data."""
@@ -60,7 +70,7 @@ class User(UserMixin, db.Model):
     manual_score_date = db.Column(db.Date, nullable=True)
     
     # Subscription
-    subscription_tier = db.Column(db.String(20), default='free_tier', nullable=False)
+    subscription_tier = db.Column(db.String(20), default=TIER_FREE, nullable=False)
     plan_generations_count = db.Column(db.Integer, default=0, nullable=False)
     plan_generation_reset_date = db.Column(db.Date, nullable=True)
     has_paid_before = db.Column(db.Boolean, default=False, nullable=False)
@@ -101,12 +111,38 @@ class User(UserMixin, db.Model):
     @property
     def is_admin(self) -> bool:
         """Check if user has admin privileges."""
-        return self.subscription_tier == 'admin'
+        return self.subscription_tier == TIER_ADMIN
     
     @property
     def is_paid(self) -> bool:
         """Check if user has paid tier access."""
-        return self.subscription_tier in ('paid_tier', 'admin')
+        return self.subscription_tier in PAID_TIERS
+    
+    @property
+    def parsed_google_creds(self):
+        """The stored Google credentials as a dict, or None for a legacy bare token.
+        
+        Parsed once and memoized against the raw column value, so a token
+        reloaded from the database is never served from a stale parse.
+        """
+        token = self.google_token
+        cached = getattr(self, '_parsed_creds', None)
+        if cached is not None and cached[0] is token:
+            return cached[1]
+        parsed = None
+        if token and token.startswith('{'):
+            try:
+                parsed = json.loads(token)
+            except ValueError:
+                parsed = None
+        self._parsed_creds = (token, parsed)
+        return parsed
+    
+    @validates('google_token')
+    def _invalidate_parsed_creds(self, key, value):
+        """Drop the memoized credentials whenever a new token is assigned."""
+        self._parsed_creds = None
+        return value
 
     def __repr__(self) -> str:
         return f'<User {self.username}>'
@@ -137,6 +173,10 @@ class Appointment(db.Model):
     """User calendar appointment for schedule constraints."""
     
     __tablename__ = 'appointment'
+    __table_args__ = (
+        # Range lookups of a user's appointments (calendar import duplicate check)
+        db.Index('ix_appt_user_date', 'user_id', 'date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
@@ -382,6 +422,10 @@ class Transaction(db.Model):
     """Payment transaction record for Stripe payments."""
     
     __tablename__ = 'transactions'
+    __table_args__ = (
+        # payment_success checks whether a session's transaction is already completed
+        db.Index('ix_transactions_session_status', 'stripe_session_id', 'status'),
+    )
     
     id = db.Column('transaction_id', db.Integer, primary_key=True)
     user_id = db.Column(
@@ -405,3 +449,15 @@ class Transaction(db.Model):
 
     def __repr__(self) -> str:
         return f'<Transaction {self.id} - {self.status}>'
+
+
+class WebhookEvent(db.Model):
+    """Stripe webhook event IDs already accepted, for dropping redeliveries."""
+    
+    __tablename__ = 'webhook_events'
+    
+    id = db.Column(db.String(255), primary_key=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self) -> str:
+        return f'<WebhookEvent {self.id}>'
@@ -2,23 +2,155 @@
 Third-party integration routes for Fitbit, Google Fit, and Oura.
 """
 import base64
+import hmac
 import json
 import os
 import random
-from datetime import datetime
-from urllib.parse import quote
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
 
 import requests
-from flask import Blueprint, redirect, url_for, flash, request, session, render_template
+from requests.adapters import HTTPAdapter
+from requests.models import PreparedRequest
+from urllib3.util.retry import Retry
+from flask import Blueprint, redirect, url_for, flash, request, render_template
 from flask_login import login_required, current_user
-from google.auth.transport import requests as google_requests
-from google.oauth2 import id_token
-from google_auth_oauthlib.flow import Flow
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import update
 
 from config import config
-from models import db
+from models import db, User, PAID_TIERS, TIER_FREE
+from utils.logging_config import get_logger
 
 integrations_bp = Blueprint('integrations', __name__)
+logger = get_logger(__name__)
+
+# Shared read-only fallback for missing nested dicts in API payloads
+_EMPTY: dict = {}
+
+# Shared pooled HTTP session for Fitbit and Google calls; keep-alive reuses TLS connections
+# and JSON payloads are requested gzip-compressed. Retries only apply to idempotent methods.
+# 429 is not retried: Fitbit's Retry-After runs until the hourly limit resets, which would
+# park the request thread for up to an hour per attempt.
+_SESSION = requests.Session()
+_SESSION.headers.update({'Accept-Encoding': 'gzip, deflate', 'Accept': 'application/json'})
+_ADAPTER = HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+)
+_SESSION.mount('https://', _ADAPTER)
+_SESSION.mount('http://', _ADAPTER)
+
+# Fitbit daily score endpoints, formatted with a YYYY-MM-DD date
+_READINESS_URL_TMPL = "https://api.fitbit.com/1/user/-/activities/readiness/date/%s.json"
+_SLEEP_URL_TMPL = "https://api.fitbit.com/1.2/user/-/sleep/date/%s.json"
+
+# Lets the readiness and sleep requests overlap within a request; both are awaited before it returns
+_FETCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='fitbit-fetch')
+
+# Fitbit daily scores keyed by (user_id, date, kind): {key: (expires_at, score)}.
+# Keeps reconnects and refreshes within the window off Fitbit's 150 requests/hour limit.
+_FITBIT_SCORE_CACHE: dict = {}
+_FITBIT_SCORE_CACHE_MAX = 10000
+_FITBIT_SCORE_TTL = 900
+
+# OAuth client config for the Google account-connect flow (constant per process)
+_GOOGLE_CLIENT_CONFIG = {
+    "web": {
+        "client_id": config.GOOGLE_CLIENT_ID,
+        "client_secret": config.GOOGLE_CLIENT_SECRET,
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "redirect_uris": [config.GOOGLE_CONNECT_REDIRECT_URI]
+    }
+}
+
+# Imported calendar event categories, checked in priority order against the title
+_APPOINTMENT_TYPE_PATTERNS = (
+    ('Work', re.compile(r'work|meeting|call|standup|sync', re.IGNORECASE)),
+    ('School', re.compile(r'class|lecture|study|exam|school', re.IGNORECASE)),
+    ('Medical', re.compile(r'doctor|dentist|appointment|checkup|medical', re.IGNORECASE)),
+    ('Social', re.compile(r'dinner|lunch|coffee|party|hangout', re.IGNORECASE)),
+)
+
+# Dedicated PRNG for mock tracker scores (not used for anything security-sensitive)
+_RNG = random.Random()
+
+# OAuth state tokens live in short-lived signed cookies rather than the session
+_STATE_COOKIE_MAX_AGE = 600
+_STATE_SERIALIZER = URLSafeTimedSerializer(config.SECRET_KEY, salt='oauth-state')
+
+
+def _set_state_cookie(response, name, state):
+    """Attach a signed OAuth state token cookie to the response."""
+    response.set_cookie(
+        name,
+        _STATE_SERIALIZER.dumps(state),
+        max_age=_STATE_COOKIE_MAX_AGE,
+        httponly=True,
+        secure=True,
+        samesite='Lax'
+    )
+    return response
+
+
+def _read_state_cookie(name):
+    """Return the OAuth state token from a signed cookie, or None if missing or invalid."""
+    signed_state = request.cookies.get(name)
+    if not signed_state:
+        return None
+    try:
+        return _STATE_SERIALIZER.loads(signed_state, max_age=_STATE_COOKIE_MAX_AGE)
+    except BadSignature:
+        return None
+
+
+@lru_cache(maxsize=None)
+def _google_deps():
+    """Import the Google OAuth libraries on first use.
+    
+    Returns:
+        Tuple of (Flow, google.auth.transport.requests, google.oauth2.id_token).
+    """
+    from google.auth.transport import requests as google_requests
+    from google.oauth2 import id_token
+    from google_auth_oauthlib.flow import Flow
+    return Flow, google_requests, id_token
+
+
+@lru_cache(maxsize=None)
+def _google_auth_request():
+    """Return a shared Google transport request whose HTTP session is reused for verification."""
+    _, google_requests, _ = _google_deps()
+    return google_requests.Request()
+
+
+def _classify_appointment(title):
+    """Map a calendar event title to an appointment type."""
+    for apt_type, pattern in _APPOINTMENT_TYPE_PATTERNS:
+        if pattern.search(title):
+            return apt_type
+    return 'Other'
+
+
+def _update_user(fields):
+    """Write the given columns for the current user in a single UPDATE and commit."""
+    db.session.execute(
+        update(User).where(User.id == current_user.id).values(**fields)
+    )
+    db.session.commit()
+
+
+def _state_matches(expected, received):
+    """Compare OAuth state tokens in constant time."""
+    return hmac.compare_digest(
+        (expected or '').encode('utf-8'),
+        (received or '').encode('utf-8')
+    )
 
 
 @integrations_bp.route('/connect_fitbit', methods=['GET', 'POST'])
@@ -27,12 +159,19 @@ def connect_fitbit():
     """Initiate Fitbit OAuth flow."""
     if not config.FITBIT_CLIENT_ID or not config.FITBIT_CLIENT_SECRET:
         # Fallback to mock data if Fitbit OAuth not configured
-        current_user.fitbit_connected = True
-        # Generate more realistic mock scores (30-70 range for variety)
-        current_user.fitbit_readiness_score = random.randint(30, 70)
-        current_user.fitbit_sleep_score = random.randint(35, 75)
-        db.session.commit()
-        flash(f'Fitbit connected (Mock data)! Readiness: {current_user.fitbit_readiness_score}/100, Sleep: {current_user.fitbit_sleep_score}/100', 'success')
+        # Reconnecting keeps the existing mock scores so no write is needed
+        readiness_score = current_user.fitbit_readiness_score
+        sleep_score = current_user.fitbit_sleep_score
+        if not current_user.fitbit_connected or readiness_score is None or sleep_score is None:
+            # Generate more realistic mock scores (30-70 range for variety)
+            readiness_score = _RNG.randrange(30, 71)
+            sleep_score = _RNG.randrange(35, 76)
+            _update_user({
+                'fitbit_connected': True,
+                'fitbit_readiness_score': readiness_score,
+                'fitbit_sleep_score': sleep_score,
+            })
+        flash(f'Fitbit connected (Mock data)! Readiness: {readiness_score}/100, Sleep: {sleep_score}/100', 'success')
         return redirect(request.referrer or url_for('activities.log'))
     
     # Real Fitbit OAuth flow
@@ -41,7 +180,6 @@ def connect_fitbit():
     
     # Create state token for security
     state = base64.urlsafe_b64encode(os.urandom(32)).decode('utf-8')
-    session['fitbit_state'] = state
     
     params = {
         'response_type': 'code',
@@ -51,8 +189,9 @@ def connect_fitbit():
         'state': state
     }
     
-    auth_request_url = f"{auth_url}?{'&'.join([f'{k}={quote(str(v))}' for k, v in params.items()])}"
-    return redirect(auth_request_url)
+    prepared = PreparedRequest()
+    prepared.prepare_url(auth_url, params)
+    return _set_state_cookie(redirect(prepared.url), 'fitbit_state', state)
 
 
 @integrations_bp.route('/callback/fitbit')
@@ -64,8 +203,8 @@ def callback_fitbit():
         return redirect(url_for('activities.log'))
     
     # Verify state
-    state = session.get('fitbit_state')
-    if not state or state != request.args.get('state'):
+    state = _read_state_cookie('fitbit_state')
+    if not state or not _state_matches(state, request.args.get('state')):
         flash('Invalid state parameter.', 'error')
         return redirect(url_for('activities.log'))
     
@@ -93,13 +232,15 @@ def callback_fitbit():
             'redirect_uri': config.FITBIT_REDIRECT_URI
         }
         
-        response = requests.post(token_url, headers=headers, data=data, timeout=10)
+        response = _SESSION.post(token_url, headers=headers, data=data, timeout=10)
         token_data = response.json()
         
         if 'access_token' in token_data:
             # Store tokens
-            current_user.fitbit_token = json.dumps(token_data)
-            current_user.fitbit_connected = True
+            user = current_user._get_current_object()
+            user.fitbit_token = json.dumps(token_data)
+            user.fitbit_connected = True
+            db.session.commit()
             
             # Fetch user's data from Fitbit API
             access_token = token_data['access_token']
@@ -110,92 +251,141 @@ def callback_fitbit():
                 today = datetime.utcnow().strftime('%Y-%m-%d')
             fitbit_headers = {'Authorization': f'Bearer {access_token}'}
             
-            print(f"[Fitbit] Fetching data for user {current_user.id} on {today}")
-            
-            # Get readiness score (Premium feature)
-            _fetch_fitbit_readiness(fitbit_headers, today)
-            print(f"[Fitbit] Readiness score: {current_user.fitbit_readiness_score}")
-            
-            # Get sleep score (available to all users)
-            _fetch_fitbit_sleep(fitbit_headers, today)
-            print(f"[Fitbit] Sleep score: {current_user.fitbit_sleep_score}")
-            
-            db.session.commit()
-            session.pop('fitbit_state', None)
+            # Fetch the scores in the request; the token is already committed, so no
+            # database transaction is held open across the Fitbit calls
+            user.fitbit_readiness_score, user.fitbit_sleep_score = _fetch_fitbit_scores(
+                user.id, fitbit_headers, today
+            )
+            if db.session.is_modified(user):
+                db.session.commit()
+            logger.info(
+                "[Fitbit] Synced scores for user %s: readiness=%s, sleep=%s",
+                user.id, user.fitbit_readiness_score, user.fitbit_sleep_score
+            )
             
             message = 'Fitbit connected successfully! '
-            if current_user.fitbit_readiness_score:
-                message += f'Readiness: {current_user.fitbit_readiness_score}/100'
-            if current_user.fitbit_sleep_score:
-                message += f', Sleep: {current_user.fitbit_sleep_score}%'
+            if user.fitbit_readiness_score:
+                message += f'Readiness: {user.fitbit_readiness_score}/100'
+            if user.fitbit_sleep_score:
+                message += f', Sleep: {user.fitbit_sleep_score}%'
             flash(message, 'success')
         else:
             flash('Failed to get Fitbit access token.', 'error')
             
-    except Exception as e:
-        print(f"Fitbit connection error: {e}")
+    except Exception:
+        logger.exception("[Fitbit] Connection error")
         flash('Failed to connect Fitbit.', 'error')
     
-    return redirect(url_for('activities.log'))
+    response = redirect(url_for('activities.log'))
+    response.delete_cookie('fitbit_state')
+    return response
+
+
+def _fetch_fitbit_scores(user_id, fitbit_headers, today):
+    """Fetch readiness and sleep scores concurrently, reusing recently fetched values.
+    
+    Returns:
+        Tuple of (readiness_score, sleep_score); either may be None.
+    """
+    readiness_future = _FETCH_POOL.submit(
+        _cached_fitbit_score, user_id, today, 'readiness', _fetch_fitbit_readiness, fitbit_headers
+    )
+    sleep_score = _cached_fitbit_score(user_id, today, 'sleep', _fetch_fitbit_sleep, fitbit_headers)
+    return readiness_future.result(), sleep_score
+
+
+def _cached_fitbit_score(user_id, today, kind, fetch, fitbit_headers):
+    """Return a cached Fitbit score for the user and day, calling fetch on a miss.
+    
+    Missing scores are not cached so a day Fitbit hasn't synced yet is retried.
+    """
+    key = (user_id, today, kind)
+    now = time.time()
+    cached = _FITBIT_SCORE_CACHE.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    score = fetch(fitbit_headers, today)
+    if score is not None:
+        if len(_FITBIT_SCORE_CACHE) >= _FITBIT_SCORE_CACHE_MAX:
+            _FITBIT_SCORE_CACHE.clear()
+        _FITBIT_SCORE_CACHE[key] = (now + _FITBIT_SCORE_TTL, score)
+    return score
+
+
+def _forget_fitbit_scores(user_id):
+    """Drop all cached Fitbit scores for a user."""
+    for key in list(_FITBIT_SCORE_CACHE):
+        if key[0] == user_id:
+            _FITBIT_SCORE_CACHE.pop(key, None)
 
 
 def _fetch_fitbit_readiness(fitbit_headers, today):
-    """Fetch readiness score from Fitbit API."""
+    """Fetch readiness score from Fitbit API.
+    
+    Returns:
+        Readiness score, or None if unavailable.
+    """
     try:
-        readiness_url = f"https://api.fitbit.com/1/user/-/activities/readiness/date/{today}.json"
-        readiness_response = requests.get(readiness_url, headers=fitbit_headers, timeout=10)
-        
-        print(f"[Fitbit] Readiness API status: {readiness_response.status_code}")
-        
-        if readiness_response.status_code == 200:
-            readiness_data = readiness_response.json()
-            print(f"[Fitbit] Readiness data: {readiness_data}")
-            if 'score' in readiness_data:
-                current_user.fitbit_readiness_score = int(readiness_data['score'])
-            elif 'value' in readiness_data:
-                current_user.fitbit_readiness_score = int(readiness_data['value'])
-            else:
-                current_user.fitbit_readiness_score = None
-        else:
-            print(f"[Fitbit] Readiness API error: {readiness_response.text}")
-            current_user.fitbit_readiness_score = None
-    except Exception as e:
-        print(f"[Fitbit] Readiness fetch error: {e}")
-        current_user.fitbit_readiness_score = None
+        readiness_url = _READINESS_URL_TMPL % today
+        readiness_response = _SESSION.get(readiness_url, headers=fitbit_headers, timeout=10, stream=True)
+        
+        logger.debug("[Fitbit] Readiness API status: %s", readiness_response.status_code)
+        
+        if readiness_response.status_code != 200:
+            logger.warning("[Fitbit] Readiness API error: status %s", readiness_response.status_code)
+            readiness_response.close()
+            return None
+        
+        readiness_data = json.loads(readiness_response.content) or _EMPTY
+        logger.debug("[Fitbit] Readiness data: %s", readiness_data)
+        if 'score' in readiness_data:
+            return int(readiness_data['score'])
+        if 'value' in readiness_data:
+            return int(readiness_data['value'])
+        return None
+    except Exception:
+        logger.exception("[Fitbit] Readiness fetch error")
+        return None
 
 
 def _fetch_fitbit_sleep(fitbit_headers, today):
-    """Fetch sleep score from Fitbit API."""
+    """Fetch sleep score from Fitbit API.
+    
+    Returns:
+        Sleep score, or None if unavailable.
+    """
     try:
-        sleep_url = f"https://api.fitbit.com/1.2/user/-/sleep/date/{today}.json"
-        sleep_response = requests.get(sleep_url, headers=fitbit_headers, timeout=10)
-        
-        print(f"[Fitbit] Sleep API status: {sleep_response.status_code}")
-        
-        if sleep_response.status_code == 200:
-            sleep_data = sleep_response.json()
-            print(f"[Fitbit] Sleep data summary: {sleep_data.get('summary', {})}")
-            
-            if sleep_data.get('sleep') and len(sleep_data['sleep']) > 0:
-                sleep_log = sleep_data['sleep'][0]
-                
-                # Check for overall sleep score
-                if 'sleepScore' in sleep_log:
-                    current_user.fitbit_sleep_score = int(sleep_log['sleepScore'])
-                elif 'efficiency' in sleep_log:
-                    current_user.fitbit_sleep_score = int(sleep_log['efficiency'])
-                else:
-                    current_user.fitbit_sleep_score = None
-                
-                # Note: Fitbit Daily Readiness Score is a separate metric
-                # We do NOT calculate it from sleep data
-            else:
-                current_user.fitbit_sleep_score = None
-        else:
-            current_user.fitbit_sleep_score = None
-    except Exception as e:
-        print(f"Fitbit sleep fetch error: {e}")
-        current_user.fitbit_sleep_score = None
+        sleep_url = _SLEEP_URL_TMPL % today
+        sleep_response = _SESSION.get(sleep_url, headers=fitbit_headers, timeout=10, stream=True)
+        
+        logger.debug("[Fitbit] Sleep API status: %s", sleep_response.status_code)
+        
+        if sleep_response.status_code != 200:
+            sleep_response.close()
+            return None
+        
+        # json.loads takes the UTF-8 bytes directly, skipping requests' charset detection
+        sleep_data = json.loads(sleep_response.content) or _EMPTY
+        sleep_list = sleep_data.get('sleep') or ()
+        summary = sleep_data.get('summary') or _EMPTY
+        logger.debug("[Fitbit] Sleep data summary: %s", summary)
+        
+        if not sleep_list:
+            return None
+        
+        # Check for overall sleep score
+        # Note: Fitbit Daily Readiness Score is a separate metric
+        # We do NOT calculate it from sleep data
+        sleep_log = sleep_list[0]
+        if 'sleepScore' in sleep_log:
+            return int(sleep_log['sleepScore'])
+        if 'efficiency' in sleep_log:
+            return int(sleep_log['efficiency'])
+        return None
+    except Exception:
+        logger.exception("[Fitbit] Sleep fetch error")
+        return None
 
 
 @integrations_bp.route('/debug/fitbit')
@@ -234,12 +424,14 @@ def refresh_fitbit():
         headers = {'Authorization': f'Bearer {access_token}'}
         # Use server local date; in most cases this will align after sync
         today = datetime.now().strftime('%Y-%m-%d')
-        _fetch_fitbit_readiness(headers, today)
-        _fetch_fitbit_sleep(headers, today)
-        db.session.commit()
+        current_user.fitbit_readiness_score, current_user.fitbit_sleep_score = _fetch_fitbit_scores(
+            current_user.id, headers, today
+        )
+        if db.session.is_modified(current_user):
+            db.session.commit()
         flash('Fitbit data refreshed.', 'success')
-    except Exception as e:
-        print(f"[Fitbit] Refresh error: {e}")
+    except Exception:
+        logger.exception("[Fitbit] Refresh error")
         flash('Failed to refresh Fitbit data.', 'error')
     return redirect(url_for('planning.plan'))
 
@@ -270,16 +462,9 @@ def connect_google_continue():
         return redirect(url_for('activities.log'))
     
     # Create flow instance
+    Flow, _, _ = _google_deps()
     flow = Flow.from_client_config(
-        {
-            "web": {
-                "client_id": config.GOOGLE_CLIENT_ID,
-                "client_secret": config.GOOGLE_CLIENT_SECRET,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [config.GOOGLE_CONNECT_REDIRECT_URI]
-            }
-        },
+        _GOOGLE_CLIENT_CONFIG,
         scopes=config.GOOGLE_SCOPES,
         redirect_uri=config.GOOGLE_CONNECT_REDIRECT_URI
     )
@@ -290,8 +475,7 @@ def connect_google_continue():
         prompt='consent'
     )
     
-    session['connect_state'] = state
-    return redirect(authorization_url)
+    return _set_state_cookie(redirect(authorization_url), 'connect_state', state)
 
 
 @integrations_bp.route('/callback/connect-google')
@@ -306,31 +490,24 @@ def callback_connect_google():
         flash('Google OAuth is not configured.', 'error')
         return redirect(url_for('activities.log'))
     
-    # Get state from request args (more reliable than session in Cloud Run)
+    # Get state from request args (more reliable than stored state in Cloud Run)
     state = request.args.get('state')
-    session_state = session.get('connect_state')
+    cookie_state = _read_state_cookie('connect_state')
     
     # Accept state from either source
     if not state:
         flash('Missing state parameter. Please try again.', 'error')
         return redirect(url_for('activities.log'))
     
-    # Warn but don't fail if session state doesn't match (Cloud Run session issues)
-    if session_state and session_state != state:
-        print(f"[Google Connect] State mismatch: session={session_state}, request={state}")
+    # Warn but don't fail if cookie state doesn't match (Cloud Run cookie issues)
+    if cookie_state and not _state_matches(cookie_state, state):
+        logger.warning("[Google Connect] State mismatch between cookie and request")
     
     try:
         # Create flow instance
+        Flow, _, id_token = _google_deps()
         flow = Flow.from_client_config(
-            {
-                "web": {
-                    "client_id": config.GOOGLE_CLIENT_ID,
-                    "client_secret": config.GOOGLE_CLIENT_SECRET,
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token",
-                    "redirect_uris": [config.GOOGLE_CONNECT_REDIRECT_URI]
-                }
-            },
+            _GOOGLE_CLIENT_CONFIG,
             scopes=config.GOOGLE_SCOPES,
             state=state,
             redirect_uri=config.GOOGLE_CONNECT_REDIRECT_URI
@@ -343,13 +520,12 @@ def callback_connect_google():
         credentials = flow.credentials
         
         # Debug: Check what scopes the credentials actually have
-        print(f"[Google Connect] Credentials scopes: {credentials.scopes}")
-        print(f"[Google Connect] Has calendar scope: {'https://www.googleapis.com/auth/calendar.events' in (credentials.scopes or [])}")
+        logger.debug("[Google Connect] Credentials scopes: %s", credentials.scopes)
         
         # Verify token and get user info
         idinfo = id_token.verify_oauth2_token(
             credentials.id_token,
-            google_requests.Request(),
+            _google_auth_request(),
             config.GOOGLE_CLIENT_ID
         )
         
@@ -363,23 +539,25 @@ def callback_connect_google():
             'token_uri': credentials.token_uri,
             'client_id': credentials.client_id,
             'client_secret': credentials.client_secret,
-            'scopes': credentials.scopes
+            'scopes': credentials.scopes,
+            'expiry': credentials.expiry.isoformat() if credentials.expiry else None
         }
         
         current_user.google_id = google_id
         current_user.google_token = json.dumps(credentials_dict)
         current_user.google_refresh_token = credentials.refresh_token
         
-        print(f"[Google Connect] Stored credentials with scopes for user {current_user.id}")
+        logger.info("[Google Connect] Stored credentials with scopes for user %s", current_user.id)
         
         db.session.commit()
-        session.pop('connect_state', None)
         
         flash('Google account connected successfully!', 'success')
-        return redirect(url_for('activities.log'))
+        response = redirect(url_for('activities.log'))
+        response.delete_cookie('connect_state')
+        return response
         
-    except Exception as e:
-        print(f"Google connect error: {e}")
+    except Exception:
+        logger.exception("[Google Connect] Connection error")
         flash('Failed to connect Google account. Please try again.', 'error')
         return redirect(url_for('activities.log'))
 
@@ -388,10 +566,12 @@ def callback_connect_google():
 @login_required
 def connect_oura():
     """Connect Oura ring (mock implementation)."""
-    current_user.oura_connected = True
-    current_user.oura_readiness_score = random.randint(65, 95)
-    db.session.commit()
-    flash(f'Oura connected successfully! Current readiness: {current_user.oura_readiness_score}/100 (Mock data)', 'success')
+    # Reconnecting keeps the existing mock score so no write is needed
+    readiness_score = current_user.oura_readiness_score
+    if not current_user.oura_connected or readiness_score is None:
+        readiness_score = _RNG.randrange(65, 96)
+        _update_user({'oura_connected': True, 'oura_readiness_score': readiness_score})
+    flash(f'Oura connected successfully! Current readiness: {readiness_score}/100 (Mock data)', 'success')
     return redirect(url_for('activities.log'))
 
 
@@ -404,22 +584,19 @@ def disconnect_google():
         if current_user.google_token:
             try:
                 # Parse token if it's JSON
-                if current_user.google_token.startswith('{'):
-                    token_data = json.loads(current_user.google_token)
+                token_data = current_user.parsed_google_creds
+                if token_data is not None:
                     access_token = token_data.get('access_token') or token_data.get('token')
                 else:
                     access_token = current_user.google_token
                 
                 # Revoke the token
                 revoke_url = f'https://oauth2.googleapis.com/revoke?token={access_token}'
-                requests.post(revoke_url, timeout=5)
-            except Exception as e:
-                print(f"Error revoking Google token: {e}")
+                _SESSION.post(revoke_url, timeout=5)
+            except Exception:
+                logger.exception("[Google Disconnect] Error revoking Google token")
         
-        current_user.google_id = None
-        current_user.google_token = None
-        current_user.google_refresh_token = None
-        db.session.commit()
+        _update_user({'google_id': None, 'google_token': None, 'google_refresh_token': None})
         flash('Google account disconnected successfully! Please reconnect to grant calendar permissions.', 'success')
     else:
         flash('No Google account connected.', 'info')
@@ -431,11 +608,13 @@ def disconnect_google():
 def disconnect_fitbit():
     """Disconnect Fitbit from user."""
     if current_user.fitbit_connected:
-        current_user.fitbit_connected = False
-        current_user.fitbit_token = None
-        current_user.fitbit_readiness_score = None
-        current_user.fitbit_sleep_score = None
-        db.session.commit()
+        _update_user({
+            'fitbit_connected': False,
+            'fitbit_token': None,
+            'fitbit_readiness_score': None,
+            'fitbit_sleep_score': None,
+        })
+        _forget_fitbit_scores(current_user.id)
         flash('Fitbit disconnected successfully!', 'success')
     else:
         flash('No Fitbit account connected.', 'info')
@@ -447,9 +626,7 @@ def disconnect_fitbit():
 def disconnect_oura():
     """Disconnect Oura ring from user."""
     if current_user.oura_connected:
-        current_user.oura_connected = False
-        current_user.oura_readiness_score = None
-        db.session.commit()
+        _update_user({'oura_connected': False, 'oura_readiness_score': None})
         flash('Oura disconnected successfully!', 'success')
     else:
         flash('No Oura account connected.', 'info')
@@ -465,23 +642,22 @@ def import_calendar_events():
     from datetime import timedelta
     from models import Appointment
     
-    print(f"[Calendar Import] Request from user {current_user.id}")
+    user = current_user._get_current_object()
+    user_id = user.id
+    logger.info("[Calendar Import] Request from user %s", user_id)
     
-    # Check subscription tier - only paid_tier and admin can import from calendar
-    user_tier = current_user.subscription_tier or 'free_tier'
-    if user_tier not in ['paid_tier', 'admin']:
-        print(f"[Calendar Import] ERROR: User tier {user_tier} not authorized")
+    # Check subscription tier - only paid and admin tiers can import from calendar
+    user_tier = user.subscription_tier or TIER_FREE
+    if user_tier not in PAID_TIERS:
+        logger.warning("[Calendar Import] User tier %s not authorized", user_tier)
         return jsonify({
             'success': False,
             'error': 'Calendar import is only available for Paid and Admin tiers. Please upgrade your subscription to access this feature.',
             'upgrade_required': True
         }), 403
     
-    print(f"[Calendar Import] Has google_token: {bool(current_user.google_token)}")
-    print(f"[Calendar Import] Has google_id: {bool(current_user.google_id)}")
-    
-    if not current_user.google_token:
-        print("[Calendar Import] ERROR: No google_token found")
+    if not user.google_token:
+        logger.warning("[Calendar Import] No google_token found for user %s", user_id)
         return jsonify({'success': False, 'error': 'Google account not connected. Please connect your Google account first.'}), 400
     
     try:
@@ -489,29 +665,25 @@ def import_calendar_events():
         from google.oauth2.credentials import Credentials
         import pytz
         
-        print(f"[Calendar Import] Parsing credentials...")
-        
         # Parse stored credentials (stored as JSON)
-        try:
-            credentials_dict = json.loads(current_user.google_token)
+        credentials_dict = user.parsed_google_creds
+        if credentials_dict is not None:
             token = credentials_dict.get('token')
             refresh_token = credentials_dict.get('refresh_token')
             scopes = credentials_dict.get('scopes', [])
-            print(f"[Calendar Import] Parsed JSON credentials - has token: {bool(token)}, scopes: {scopes}")
-        except (json.JSONDecodeError, AttributeError) as e:
+            logger.debug("[Calendar Import] Parsed JSON credentials - has token: %s, scopes: %s", bool(token), scopes)
+        else:
             # Fallback if token is stored as plain string
-            print(f"[Calendar Import] JSON parse failed: {e}, using plain token")
-            token = current_user.google_token
-            refresh_token = current_user.google_refresh_token
+            logger.debug("[Calendar Import] Stored token is not JSON, using plain token")
+            token = user.google_token
+            refresh_token = user.google_refresh_token
             scopes = None
         
         # Validate token exists
         if not token:
-            print("[Calendar Import] ERROR: Token is empty after parsing")
+            logger.warning("[Calendar Import] Token is empty after parsing")
             return jsonify({'success': False, 'error': 'Invalid Google credentials. Please reconnect your Google account.'}), 400
         
-        print(f"[Calendar Import] Creating credentials object...")
-        
         # Create credentials from stored token
         creds = Credentials(
             token=token,
@@ -526,8 +698,8 @@ def import_calendar_events():
         if refresh_token:
             try:
                 from google.auth.transport.requests import Request
-                print(f"[Calendar Import] Refreshing token...")
-                creds.refresh(Request())
+                logger.debug("[Calendar Import] Refreshing token")
+                creds.refresh(Request(session=_SESSION))
                 
                 # Update stored token
                 credentials_dict = {
@@ -536,27 +708,24 @@ def import_calendar_events():
                     'token_uri': creds.token_uri,
                     'client_id': creds.client_id,
                     'client_secret': creds.client_secret,
-                    'scopes': creds.scopes
+                    'scopes': creds.scopes,
+                    'expiry': creds.expiry.isoformat() if creds.expiry else None
                 }
-                current_user.google_token = json.dumps(credentials_dict)
-                current_user.google_refresh_token = creds.refresh_token
+                user.google_token = json.dumps(credentials_dict)
+                user.google_refresh_token = creds.refresh_token
                 db.session.commit()
-                print(f"[Calendar Import] Token refreshed successfully")
+                logger.debug("[Calendar Import] Token refreshed successfully")
             except Exception as refresh_error:
-                print(f"[Calendar Import] Token refresh failed: {refresh_error}")
+                logger.warning("[Calendar Import] Token refresh failed: %s", refresh_error)
                 return jsonify({
                     'success': False,
                     'error': 'Your Google connection has expired. Please disconnect and reconnect your Google account.',
                     'reconnect_required': True
                 }), 401
         
-        print(f"[Calendar Import] Building calendar service...")
-        
         # Build calendar service
         service = build('calendar', 'v3', credentials=creds)
         
-        print(f"[Calendar Import] Fetching events...")
-        
         # Get events for the next 30 days
         now = datetime.utcnow()
         time_min = now.isoformat() + 'Z'
@@ -569,19 +738,23 @@ def import_calendar_events():
             timeMax=time_max,
             maxResults=50,
             singleEvents=True,
-            orderBy='startTime'
+            orderBy='startTime',
+            # Only the fields read below; private properties mark events we exported
+            fields='items(summary,description,start,end,extendedProperties/private)'
         ).execute()
         
         events = events_result.get('items', [])
         imported_count = 0
         skipped_exported = 0
         
+        # First pass: filter and parse events so duplicates can be checked with one query
+        candidates = []
         for event in events:
             # Skip events that were exported from our app
             extended_props = event.get('extendedProperties', {})
             private_props = extended_props.get('private', {})
             if private_props.get('exportedFrom') == 'aiActivityPlanner':
-                print(f"[Calendar Import] Skipping app-exported event: {event.get('summary', 'Untitled')}")
+                logger.debug("[Calendar Import] Skipping app-exported event: %s", event.get('summary', 'Untitled'))
                 skipped_exported += 1
                 continue
             
@@ -596,65 +769,57 @@ def import_calendar_events():
             if not start:
                 continue
             
-            # Check if event already exists (avoid duplicates)
             if 'dateTime' in event['start']:
-                # Timed event
-                start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
+                # Timed event (fromisoformat accepts a trailing 'Z' on Python 3.11+)
+                start_dt = datetime.fromisoformat(start)
                 event_date = start_dt.date()
                 event_time = start_dt.time()
                 
                 # Calculate duration
                 end = event['end'].get('dateTime', event['end'].get('date'))
                 if end:
-                    end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
+                    end_dt = datetime.fromisoformat(end)
                     duration = int((end_dt - start_dt).total_seconds() / 60)
                 else:
                     duration = 60  # Default 1 hour
             else:
                 # All-day event
-                event_date = datetime.fromisoformat(start).date()
+                event_date = date.fromisoformat(start)
                 event_time = None
                 duration = None
             
+            candidates.append((event, title, event_date, event_time, duration))
+        
+        # Load existing appointments in the imported date range once.
+        # Keys are (title, date, time); all-day appointments have time None, so timed
+        # events match on exact time and all-day events only match other all-day ones.
+        existing_set = set()
+        if candidates:
+            min_date = min(c[2] for c in candidates)
+            max_date = max(c[2] for c in candidates)
+            existing_rows = db.session.query(
+                Appointment.title, Appointment.date, Appointment.time
+            ).filter(
+                Appointment.user_id == user_id,
+                Appointment.date.between(min_date, max_date)
+            ).all()
+            existing_set = {(t, d, tm) for t, d, tm in existing_rows}
+        
+        new_appointments = []
+        for event, title, event_date, event_time, duration in candidates:
             # Check for duplicate - compare title, date, and time to avoid duplicates
-            if event_time:
-                # For timed events, check exact match with time
-                existing = Appointment.query.filter_by(
-                    user_id=current_user.id,
-                    title=title,
-                    date=event_date,
-                    time=event_time
-                ).first()
-            else:
-                # For all-day events, check title and date only
-                existing = Appointment.query.filter_by(
-                    user_id=current_user.id,
-                    title=title,
-                    date=event_date
-                ).filter(Appointment.time.is_(None)).first()
-            
-            if existing:
-                print(f"[Calendar Import] Skipping duplicate: {title} on {event_date}")
+            key = (title, event_date, event_time)
+            if key in existing_set:
+                logger.debug("[Calendar Import] Skipping duplicate: %s on %s", title, event_date)
                 continue  # Skip duplicates
             
             # Determine appointment type from title/description
             description = event.get('description', '')
-            title_lower = title.lower()
-            
-            if any(word in title_lower for word in ['work', 'meeting', 'call', 'standup', 'sync']):
-                apt_type = 'Work'
-            elif any(word in title_lower for word in ['class', 'lecture', 'study', 'exam', 'school']):
-                apt_type = 'School'
-            elif any(word in title_lower for word in ['doctor', 'dentist', 'appointment', 'checkup', 'medical']):
-                apt_type = 'Medical'
-            elif any(word in title_lower for word in ['dinner', 'lunch', 'coffee', 'party', 'hangout']):
-                apt_type = 'Social'
-            else:
-                apt_type = 'Other'
+            apt_type = _classify_appointment(title)
             
             # Create appointment
             appointment = Appointment(
-                user_id=current_user.id,
+                user_id=user_id,
                 title=title,
                 appointment_type=apt_type,
                 date=event_date,
@@ -664,12 +829,18 @@ def import_calendar_events():
                 repeating_days=None  # Google Calendar recurring events handled separately
             )
             
-            db.session.add(appointment)
+            new_appointments.append(appointment)
+            existing_set.add(key)
             imported_count += 1
         
+        if new_appointments:
+            db.session.bulk_save_objects(new_appointments)
         db.session.commit()
         
-        print(f"[Calendar Import] Successfully imported {imported_count} events for user {current_user.id}, skipped {skipped_exported} app-exported events")
+        logger.info(
+            "[Calendar Import] Imported %d events for user %s, skipped %d app-exported events",
+            imported_count, user_id, skipped_exported
+        )
         
         # Build success message
         message = f'Successfully imported {imported_count} event(s) from Google Calendar'
@@ -684,10 +855,7 @@ def import_calendar_events():
         })
         
     except Exception as e:
-        import traceback
-        error_trace = traceback.format_exc()
-        print(f"[Calendar Import] Error for user {current_user.id}: {e}")
-        print(f"[Calendar Import] Full traceback:\n{error_trace}")
+        logger.exception("[Calendar Import] Error for user %s", user_id)
         return jsonify({
             'success': False,
             'error': f'Failed to import events: {str(e)}'
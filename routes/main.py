@@ -1,42 +1,95 @@
 """
 Main routes for basic pages and utility endpoints.
 """
-from flask import Blueprint, render_template, jsonify, request, redirect, url_for, flash
+import json
+import os
+import re
+
+from flask import Blueprint, Response, render_template, jsonify, request, redirect, url_for, flash, session
 from flask_login import login_required, current_user, logout_user
+from sqlalchemy import update
 
-from models import db
+from models import db, User, TIER_ADMIN, TIER_FREE, TIER_PAID, VALID_TIERS
 from utils.helpers import search_cities
+from utils.rate_limit import rate_limit
 
 
 main_bp = Blueprint('main', __name__)
 
+# Numeric profile inputs
+_INT_RE = re.compile(r'-?\d+')
+_FLOAT_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+# Numeric profile fields: (form field, pattern, type, min, max, format error, range error)
+_NUMERIC_PROFILE_FIELDS = (
+    ('age', _INT_RE, int, 13, 120,
+     'Age must be a whole number.', 'Age must be between 13 and 120.'),
+    ('height_cm', _INT_RE, int, 50, 300,
+     'Height must be a whole number of centimeters.', 'Height must be between 50 and 300 cm.'),
+    ('weight_kg', _FLOAT_RE, float, 20, 500,
+     'Weight must be a number in kilograms.', 'Weight must be between 20 and 500 kg.'),
+)
+
+# Rendered HTML of the content pages as seen by anonymous visitors, keyed by template name
+_ANONYMOUS_PAGE_CACHE: dict = {}
+
+# Deployment info is fixed for the life of the process, so serialize it once
+_VERSION_BODY = json.dumps({
+    'version': '2.0-modular',
+    'build_number': os.environ.get('BUILD_NUM', 'unknown'),
+    'features': [
+        'Modular architecture with blueprints',
+        'Fixed checkbox alignment',
+        'Repeating appointments',
+        'CircleCI auto-deployment'
+    ],
+    'deployed': True,
+    'environment': 'production' if not os.environ.get('FLASK_DEBUG') else 'development',
+    'app_module': __name__
+}).encode('utf-8')
+
+
+def _render_content_page(template):
+    """Render a content page, reusing the cached anonymous rendering when it applies.
+    
+    The layout shows the logged-in user and flashed messages, so only requests
+    with neither can be served from the cache.
+    """
+    if current_user.is_authenticated or '_flashes' in session:
+        return render_template(template)
+    body = _ANONYMOUS_PAGE_CACHE.get(template)
+    if body is None:
+        body = _ANONYMOUS_PAGE_CACHE[template] = render_template(template)
+    return Response(body, mimetype='text/html')
+
 
 @main_bp.route('/')
 def index():
     """Home page."""
-    return render_template('index.html')
+    return _render_content_page('index.html')
 
 
 @main_bp.route('/about')
 def about():
     """About page."""
-    return render_template('about.html')
+    return _render_content_page('about.html')
 
 
 @main_bp.route('/terms')
 def terms():
     """Terms of Service page."""
-    return render_template('terms.html')
+    return _render_content_page('terms.html')
 
 
 @main_bp.route('/privacy')
 def privacy():
     """Privacy Policy page."""
-    return render_template('privacy.html')
+    return _render_content_page('privacy.html')
 
 
 @main_bp.route('/search_cities')
 @login_required
+@rate_limit(30, 60, key_func=lambda: str(current_user.id))
 def search_cities_route():
     """Search for cities matching a query."""
     query = request.args.get('q', '').strip()
@@ -44,7 +97,10 @@ def search_cities_route():
         return jsonify([])
     
     cities = search_cities(query)
-    return jsonify(cities)
+    response = jsonify(cities)
+    # Let the browser reuse results for repeated prefixes; private since the route needs a login
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
 
 
 @main_bp.route('/toggle_temperature_unit', methods=['POST'])
@@ -64,55 +120,21 @@ def settings():
     """User settings page for profile management."""
     if request.method == 'POST':
         try:
-            # Update profile fields
-            current_user.full_name = request.form.get('full_name', '').strip() or None
-            current_user.location = request.form.get('location', '').strip() or None
-            current_user.temperature_unit = request.form.get('temperature_unit', 'C')
-            current_user.timezone = request.form.get('timezone', 'UTC')
-            
-            # Update age (with validation)
-            age_str = request.form.get('age', '').strip()
-            if age_str:
-                age = int(age_str)
-                if age < 13 or age > 120:
-                    flash('Age must be between 13 and 120.', 'danger')
-                    return redirect(url_for('main.settings'))
-                current_user.age = age
-            else:
-                current_user.age = None
-            
-            # Update gender
-            current_user.gender = request.form.get('gender', '').strip() or None
+            # Validate everything before touching the user so a bad value never dirties the session
+            fields, error = _parse_profile_form(request.form)
+            if error:
+                flash(error, 'danger')
+                return redirect(url_for('main.settings'))
             
-            # Update height (with validation)
-            height_str = request.form.get('height_cm', '').strip()
-            if height_str:
-                height = int(height_str)
-                if height < 50 or height > 300:
-                    flash('Height must be between 50 and 300 cm.', 'danger')
-                    return redirect(url_for('main.settings'))
-                current_user.height_cm = height
-            else:
-                current_user.height_cm = None
-            
-            # Update weight (with validation)
-            weight_str = request.form.get('weight_kg', '').strip()
-            if weight_str:
-                weight = float(weight_str)
-                if weight < 20 or weight > 500:
-                    flash('Weight must be between 20 and 500 kg.', 'danger')
-                    return redirect(url_for('main.settings'))
-                current_user.weight_kg = weight
-            else:
-                current_user.weight_kg = None
-            
-            db.session.commit()
+            user = current_user._get_current_object()
+            for name, value in fields.items():
+                setattr(user, name, value)
+            # The UPDATE only lists changed columns; skip the round-trip when nothing changed
+            if db.session.is_modified(user):
+                db.session.commit()
             flash('Profile updated successfully!', 'success')
             return redirect(url_for('main.settings'))
         
-        except ValueError:
-            flash('Invalid input. Please check your age, height, and weight values.', 'danger')
-            return redirect(url_for('main.settings'))
         except Exception as e:
             db.session.rollback()
             flash(f'Error updating profile: {str(e)}', 'danger')
@@ -121,39 +143,71 @@ def settings():
     return render_template('settings.html')
 
 
+def _parse_profile_form(form):
+    """Parse and validate the profile settings form in one pass.
+    
+    Returns:
+        Tuple of (fields, error); fields maps User columns to values and
+        error is a message for the first invalid field, or None.
+    """
+    values = {key: value.strip() for key, value in form.items()}
+    fields = {
+        'full_name': values.get('full_name') or None,
+        'location': values.get('location') or None,
+        'temperature_unit': values.get('temperature_unit', 'C'),
+        'timezone': values.get('timezone', 'UTC'),
+        'gender': values.get('gender') or None,
+    }
+    
+    for name, pattern, cast, low, high, format_error, range_error in _NUMERIC_PROFILE_FIELDS:
+        raw = values.get(name)
+        if not raw:
+            fields[name] = None
+            continue
+        if not pattern.fullmatch(raw):
+            return fields, format_error
+        value = cast(raw)
+        if value < low or value > high:
+            return fields, range_error
+        fields[name] = value
+    
+    return fields, None
+
+
 @main_bp.route('/update_subscription', methods=['POST'])
 @login_required
 def update_subscription():
     """Update user's subscription tier."""
+    user = current_user._get_current_object()
     try:
         new_tier = request.form.get('new_tier', '').strip()
         
         # Validate tier
-        valid_tiers = ['free_tier', 'paid_tier']
-        if new_tier not in valid_tiers:
+        if new_tier not in VALID_TIERS:
             flash('Invalid subscription tier.', 'danger')
             return redirect(url_for('main.settings'))
         
         # Prevent users from setting themselves to admin
-        if current_user.subscription_tier != 'admin' and new_tier not in valid_tiers:
+        if user.subscription_tier != TIER_ADMIN and new_tier not in VALID_TIERS:
             flash('You cannot change to admin tier.', 'danger')
             return redirect(url_for('main.settings'))
         
         # Admin users cannot downgrade themselves
-        if current_user.subscription_tier == 'admin':
+        if user.subscription_tier == TIER_ADMIN:
             flash('Admin accounts cannot change subscription tiers.', 'danger')
             return redirect(url_for('main.settings'))
         
-        old_tier = current_user.subscription_tier
-        current_user.subscription_tier = new_tier
+        old_tier = user.subscription_tier
+        fields = {'subscription_tier': new_tier}
         
         # Reset generation count when upgrading
-        if new_tier == 'paid_tier' and old_tier == 'free_tier':
-            current_user.plan_generations_count = 0
+        if new_tier == TIER_PAID and old_tier == TIER_FREE:
+            fields['plan_generations_count'] = 0
         
+        db.session.execute(update(User).where(User.id == user.id).values(**fields))
         db.session.commit()
         
-        if new_tier == 'paid_tier':
+        if new_tier == TIER_PAID:
             flash('Successfully upgraded to Paid Plan! You now have 20 generations per week.', 'success')
         else:
             flash('Successfully changed to Free Plan. You now have 3 generations per week.', 'success')
@@ -192,20 +246,11 @@ def delete_account():
 @main_bp.route('/version')
 def version():
     """Show current version info to verify deployment."""
-    import os
-    return jsonify({
-        'version': '2.0-modular',
-        'build_number': os.environ.get('BUILD_NUM', 'unknown'),
-        'features': [
-            'Modular architecture with blueprints',
-            'Fixed checkbox alignment', 
-            'Repeating appointments',
-            'CircleCI auto-deployment'
-        ],
-        'deployed': True,
-        'environment': 'production' if not os.environ.get('FLASK_DEBUG') else 'development',
-        'app_module': __name__
-    })
+    return Response(
+        _VERSION_BODY,
+        mimetype='application/json',
+        headers={'Cache-Control': 'public, max-age=60'}
+    )
 
 
 @main_bp.route('/health')
@@ -1,19 +1,37 @@
 """
 Payment routes for Stripe subscription management.
 """
+import hashlib
+import json
+import time
 from datetime import datetime
 
 import stripe
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
 from flask import Blueprint, request, jsonify, redirect, url_for, flash, render_template
 from flask_login import login_required, current_user
 
 from config import config
-from models import db, User, Transaction
+from models import db, User, Transaction, WebhookEvent, TIER_ADMIN, TIER_FREE, TIER_PAID
+from utils.logging_config import get_logger
+from utils.rate_limit import rate_limit
 from utils.status_logger import log_subscription_changed
 
 payment_bp = Blueprint('payment', __name__)
+logger = get_logger(__name__)
 
 stripe.api_key = config.STRIPE_SECRET_KEY
+# Bound how long a Stripe round-trip can hold a request thread; POST retries reuse
+# the SDK's automatic idempotency keys, so transient failures are retried safely
+stripe.max_network_retries = 2
+stripe.default_http_client = stripe.http_client.RequestsClient(timeout=15)
+
+# Webhook event types that change a user's tier or transaction records
+_HANDLED_EVENT_TYPES = frozenset(('checkout.session.completed', 'payment_intent.succeeded'))
+
+# Seconds during which repeated checkout requests from a user reuse one Stripe session
+_CHECKOUT_IDEMPOTENCY_WINDOW = 600
 
 
 @payment_bp.route('/upgrade')
@@ -36,62 +54,75 @@ def upgrade_page():
 @login_required
 def create_checkout_session():
     """Create a Stripe checkout session for subscription upgrade."""
+    user = current_user._get_current_object()
     if not config.STRIPE_SECRET_KEY or not config.STRIPE_PRICE_ID:
         flash('Payment system is not configured. Please contact support.', 'danger')
         return redirect(url_for('main.settings'))
     
     # Check if user has already paid - they can upgrade for free
-    if current_user.has_paid_before:
+    if user.has_paid_before:
         # Upgrade immediately without payment
-        old_tier = current_user.subscription_tier
-        current_user.subscription_tier = 'paid_tier'
-        current_user.plan_generations_count = 0
+        user_id, old_tier = user.id, user.subscription_tier
+        _mark_user_paid(user_id)
+        # The audit row commits with the tier change
+        log_subscription_changed(user_id, old_tier, TIER_PAID, source='user_action', commit=False)
         db.session.commit()
         
-        # Log the status change
-        log_subscription_changed(current_user.id, old_tier, 'paid_tier', source='user_action')
-        
         flash('Successfully upgraded to Paid Tier!', 'success')
         return redirect(url_for('main.settings'))
     
     # Check if already paid tier
-    if current_user.subscription_tier == 'paid_tier':
+    if user.subscription_tier == TIER_PAID:
         flash('You are already on the paid tier.', 'info')
         return redirect(url_for('main.settings'))
     
-    if current_user.subscription_tier == 'admin':
+    if user.subscription_tier == TIER_ADMIN:
         flash('Admin accounts have full access.', 'info')
         return redirect(url_for('main.settings'))
     
     try:
-        # Create Stripe Checkout Session
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
+        # Create Stripe Checkout Session. Repeat clicks within the window share an
+        # idempotency key, so Stripe hands back the same session instead of a new one.
+        # The key covers the session parameters: Stripe rejects a reused key whose
+        # parameters changed (new price, email or URLs), so such a request gets its own key.
+        session_params = {
+            'payment_method_types': ['card'],
+            'line_items': [{
                 'price': config.STRIPE_PRICE_ID,
                 'quantity': 1,
             }],
-            mode='payment',  # One-time payment for lifetime access
-            success_url=f"{config.BASE_URL}/payment/success?session_id={{CHECKOUT_SESSION_ID}}",
-            cancel_url=f"{config.BASE_URL}/payment/cancel",
-            customer_email=current_user.email,
-            metadata={
-                'user_id': current_user.id,
-                'username': current_user.username
-            }
+            'mode': 'payment',  # One-time payment for lifetime access
+            'success_url': f"{config.BASE_URL}/payment/success?session_id={{CHECKOUT_SESSION_ID}}",
+            'cancel_url': f"{config.BASE_URL}/payment/cancel",
+            'customer_email': user.email,
+            'metadata': {
+                'user_id': user.id,
+                'username': user.username
+            },
+        }
+        params_digest = hashlib.sha256(
+            json.dumps(session_params, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        idempotency_window = int(time.time() // _CHECKOUT_IDEMPOTENCY_WINDOW)
+        checkout_session = stripe.checkout.Session.create(
+            **session_params,
+            idempotency_key=f'checkout-{user.id}-{idempotency_window}-{params_digest}'
         )
         
-        # Create a pending transaction record
-        transaction = Transaction(
-            user_id=current_user.id,
-            stripe_session_id=checkout_session.id,
-            amount_cents=0,  # Will be updated on completion
-            transaction_type='subscription_upgrade',
-            status='pending',
-            description='Upgrade to Paid Tier'
-        )
-        db.session.add(transaction)
-        db.session.commit()
+        # Create a pending transaction record (once per Stripe session) in a single commit
+        already_recorded = db.session.execute(
+            select(Transaction.id).where(Transaction.stripe_session_id == checkout_session.id)
+        ).first()
+        if not already_recorded:
+            db.session.add(Transaction(
+                user_id=user.id,
+                stripe_session_id=checkout_session.id,
+                amount_cents=0,  # Will be updated on completion
+                transaction_type='subscription_upgrade',
+                status='pending',
+                description='Upgrade to Paid Tier'
+            ))
+            db.session.commit()
         
         return redirect(checkout_session.url)
         
@@ -109,6 +140,16 @@ def payment_success():
         flash('Invalid payment session.', 'danger')
         return redirect(url_for('auth.login'))
     
+    # The webhook usually lands first; a completed local record needs no Stripe round-trip
+    completed_user_id = db.session.execute(
+        select(Transaction.user_id).where(
+            Transaction.stripe_session_id == session_id,
+            Transaction.status == 'completed'
+        )
+    ).scalar()
+    if completed_user_id is not None:
+        return _payment_success_redirect(completed_user_id)
+    
     try:
         # Retrieve the session from Stripe
         checkout_session = stripe.checkout.Session.retrieve(session_id)
@@ -119,40 +160,36 @@ def payment_success():
             flash('Invalid payment session.', 'danger')
             return redirect(url_for('auth.login'))
         
-        user = User.query.get(int(user_id))
-        if not user:
+        user_id = int(user_id)
+        old_tier = db.session.execute(
+            select(User.subscription_tier).where(User.id == user_id)
+        ).scalar()
+        if old_tier is None:
             flash('User not found.', 'danger')
             return redirect(url_for('auth.login'))
         
         # Check payment status
         if checkout_session.payment_status == 'paid':
             # Update transaction record
-            transaction = Transaction.query.filter_by(stripe_session_id=session_id).first()
-            if transaction:
-                transaction.status = 'completed'
-                transaction.amount_cents = checkout_session.amount_total or 0
-                transaction.stripe_payment_intent_id = checkout_session.payment_intent
-                transaction.completed_at = datetime.utcnow()
+            db.session.execute(
+                update(Transaction)
+                .where(Transaction.stripe_session_id == session_id)
+                .values(
+                    status='completed',
+                    amount_cents=checkout_session.amount_total or 0,
+                    stripe_payment_intent_id=checkout_session.payment_intent,
+                    completed_at=datetime.utcnow()
+                )
+            )
             
             # Update user tier
-            old_tier = user.subscription_tier
-            user.subscription_tier = 'paid_tier'
-            user.has_paid_before = True
-            user.plan_generations_count = 0
+            _mark_user_paid(user_id)
             
+            # The audit row commits with the tier change
+            log_subscription_changed(user_id, old_tier, TIER_PAID, source='user_action', commit=False)
             db.session.commit()
             
-            # Log the status change
-            log_subscription_changed(user.id, old_tier, 'paid_tier', source='user_action')
-            
-            # Check if user is logged in
-            if current_user.is_authenticated and current_user.id == user.id:
-                flash('🎉 Payment successful! Welcome to the Paid Tier!', 'success')
-                return redirect(url_for('main.settings'))
-            else:
-                # User session was lost, show success and prompt to login
-                flash('🎉 Payment successful! Please log in to access your Paid Tier features.', 'success')
-                return redirect(url_for('auth.login'))
+            return _payment_success_redirect(user_id)
         else:
             flash('Payment was not completed. Please try again.', 'warning')
             return redirect(url_for('auth.login'))
@@ -162,6 +199,17 @@ def payment_success():
         return redirect(url_for('main.settings'))
 
 
+def _payment_success_redirect(user_id):
+    """Flash the payment success message and redirect based on login state."""
+    # Check if user is logged in
+    if current_user.is_authenticated and current_user.id == user_id:
+        flash('🎉 Payment successful! Welcome to the Paid Tier!', 'success')
+        return redirect(url_for('main.settings'))
+    # User session was lost, show success and prompt to login
+    flash('🎉 Payment successful! Please log in to access your Paid Tier features.', 'success')
+    return redirect(url_for('auth.login'))
+
+
 @payment_bp.route('/payment/cancel')
 def payment_cancel():
     """Handle cancelled payment."""
@@ -172,17 +220,28 @@ def payment_cancel():
         return redirect(url_for('auth.login'))
 
 
+@rate_limit(200, 1, key_func=lambda: 'stripe')
+def _reject_webhook(message):
+    """Answer a webhook that failed verification; floods of these are cut off with a 429.
+    
+    Only rejected requests count against the limit, so unsigned traffic can't
+    crowd out real Stripe deliveries.
+    """
+    return jsonify({'error': message}), 400
+
+
 @payment_bp.route('/webhook/stripe', methods=['POST'])
 def stripe_webhook():
     """Handle Stripe webhook events."""
-    payload = request.get_data(as_text=True)
+    # Raw bytes are what the signature covers; skip the text decode and the request-level cache
+    payload = request.get_data(cache=False)
     sig_header = request.headers.get('Stripe-Signature')
     
     if not config.STRIPE_WEBHOOK_SECRET:
         # Webhook secret not configured, process without verification (development)
         try:
             event = stripe.Event.construct_from(
-                request.get_json(), stripe.api_key
+                json.loads(payload), stripe.api_key
             )
         except ValueError:
             return jsonify({'error': 'Invalid payload'}), 400
@@ -193,89 +252,124 @@ def stripe_webhook():
                 payload, sig_header, config.STRIPE_WEBHOOK_SECRET
             )
         except ValueError:
-            return jsonify({'error': 'Invalid payload'}), 400
+            return _reject_webhook('Invalid payload')
         except stripe.error.SignatureVerificationError:
-            return jsonify({'error': 'Invalid signature'}), 400
+            return _reject_webhook('Invalid signature')
     
-    # Handle the event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        handle_checkout_completed(session)
-    elif event['type'] == 'payment_intent.succeeded':
-        payment_intent = event['data']['object']
-        handle_payment_succeeded(payment_intent)
+    # Process the event before answering; a 5xx makes Stripe redeliver it, and the
+    # handlers are only a couple of indexed UPDATEs
+    if event['type'] in _HANDLED_EVENT_TYPES:
+        # Stripe may deliver an event more than once; the primary key lets only the first
+        # through. The id is committed with the handler's writes, so a failed attempt
+        # leaves no row behind and Stripe's retry is processed normally
+        try:
+            db.session.add(WebhookEvent(id=event['id']))
+            db.session.flush()
+            if event['type'] == 'checkout.session.completed':
+                upgraded = handle_checkout_completed(event['data']['object'])
+                if upgraded:
+                    # The audit row commits with the tier change
+                    user_id, old_tier = upgraded
+                    log_subscription_changed(user_id, old_tier, TIER_PAID, source='system_automatic', commit=False)
+            else:
+                handle_payment_succeeded(event['data']['object'])
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'status': 'duplicate'}), 200
+        except Exception:
+            db.session.rollback()
+            logger.exception("Webhook: failed to process %s event %s", event['type'], event['id'])
+            return jsonify({'error': 'Webhook processing failed'}), 500
     
     return jsonify({'status': 'success'}), 200
 
 
 def handle_checkout_completed(session):
-    """Handle successful checkout session completion."""
+    """Handle successful checkout session completion (caller commits).
+    
+    Returns (user_id, old_tier) for the tier change to log, or None when the
+    session names no known user.
+    """
     user_id = session.get('metadata', {}).get('user_id')
     
     if not user_id:
-        print(f"Webhook: No user_id in session metadata")
+        logger.warning("Webhook: No user_id in session metadata for %s", session.get('id'))
         return
     
-    user = User.query.get(int(user_id))
-    if not user:
-        print(f"Webhook: User {user_id} not found")
+    user_id = int(user_id)
+    row = db.session.execute(
+        select(User.subscription_tier, User.username).where(User.id == user_id)
+    ).first()
+    if not row:
+        logger.warning("Webhook: User %s not found", user_id)
         return
+    old_tier, username = row
     
     # Update transaction
-    transaction = Transaction.query.filter_by(stripe_session_id=session['id']).first()
-    if transaction:
-        transaction.status = 'completed'
-        transaction.amount_cents = session.get('amount_total', 0)
-        transaction.stripe_payment_intent_id = session.get('payment_intent')
-        transaction.completed_at = datetime.utcnow()
+    db.session.execute(
+        update(Transaction)
+        .where(Transaction.stripe_session_id == session['id'])
+        .values(
+            status='completed',
+            amount_cents=session.get('amount_total', 0),
+            stripe_payment_intent_id=session.get('payment_intent'),
+            completed_at=datetime.utcnow()
+        )
+    )
     
     # Update user tier
-    old_tier = user.subscription_tier
-    user.subscription_tier = 'paid_tier'
-    user.has_paid_before = True
-    user.plan_generations_count = 0
-    
-    db.session.commit()
+    _mark_user_paid(user_id)
     
-    # Log the status change
-    log_subscription_changed(user.id, old_tier, 'paid_tier', source='system_automatic')
-    
-    print(f"Webhook: User {user.username} upgraded to paid_tier via Stripe")
+    logger.info("Webhook: User %s upgraded to %s via Stripe", username, TIER_PAID)
+    return user_id, old_tier
 
 
 def handle_payment_succeeded(payment_intent):
-    """Handle successful payment intent."""
-    # Find transaction by payment intent ID
-    transaction = Transaction.query.filter_by(
-        stripe_payment_intent_id=payment_intent['id']
-    ).first()
-    
-    if transaction and transaction.status != 'completed':
-        transaction.status = 'completed'
-        transaction.completed_at = datetime.utcnow()
-        db.session.commit()
+    """Handle successful payment intent (caller commits)."""
+    # Complete the matching transaction in one statement; already-completed rows are left alone
+    db.session.execute(
+        update(Transaction)
+        .where(
+            Transaction.stripe_payment_intent_id == payment_intent['id'],
+            Transaction.status != 'completed'
+        )
+        .values(status='completed', completed_at=datetime.utcnow())
+    )
+
+
+def _mark_user_paid(user_id):
+    """Move a user to the paid tier with a single UPDATE (caller commits)."""
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(subscription_tier=TIER_PAID, has_paid_before=True, plan_generations_count=0)
+    )
 
 
 @payment_bp.route('/downgrade', methods=['POST'])
 @login_required
 def downgrade():
     """Downgrade from paid tier to free tier."""
-    if current_user.subscription_tier == 'admin':
+    user = current_user._get_current_object()
+    if user.subscription_tier == TIER_ADMIN:
         flash('Admin accounts cannot be downgraded.', 'warning')
         return redirect(url_for('main.settings'))
     
-    if current_user.subscription_tier == 'free_tier':
+    if user.subscription_tier == TIER_FREE:
         flash('You are already on the free tier.', 'info')
         return redirect(url_for('main.settings'))
     
-    old_tier = current_user.subscription_tier
-    current_user.subscription_tier = 'free_tier'
-    current_user.plan_generations_count = 0
+    user_id, old_tier = user.id, user.subscription_tier
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(subscription_tier=TIER_FREE, plan_generations_count=0)
+    )
+    # The audit row commits with the tier change
+    log_subscription_changed(user_id, old_tier, TIER_FREE, source='user_action', commit=False)
     db.session.commit()
     
-    # Log the status change
-    log_subscription_changed(current_user.id, old_tier, 'free_tier', source='user_action')
-    
     flash('Successfully downgraded to Free Tier. You can upgrade again anytime without paying!', 'success')
     return redirect(url_for('main.settings'))
 
@@ -284,25 +378,24 @@ def downgrade():
 @login_required
 def free_upgrade():
     """Free upgrade for users who have previously paid."""
-    if not current_user.has_paid_before:
+    user = current_user._get_current_object()
+    if not user.has_paid_before:
         flash('You need to purchase the paid tier first.', 'warning')
         return redirect(url_for('payment.upgrade_page'))
     
-    if current_user.subscription_tier == 'paid_tier':
+    if user.subscription_tier == TIER_PAID:
         flash('You are already on the paid tier.', 'info')
         return redirect(url_for('main.settings'))
     
-    if current_user.subscription_tier == 'admin':
+    if user.subscription_tier == TIER_ADMIN:
         flash('Admin accounts have full access.', 'info')
         return redirect(url_for('main.settings'))
     
-    old_tier = current_user.subscription_tier
-    current_user.subscription_tier = 'paid_tier'
-    current_user.plan_generations_count = 0
+    user_id, old_tier = user.id, user.subscription_tier
+    _mark_user_paid(user_id)
+    # The audit row commits with the tier change
+    log_subscription_changed(user_id, old_tier, TIER_PAID, source='user_action', commit=False)
     db.session.commit()
     
-    # Log the status change
-    log_subscription_changed(current_user.id, old_tier, 'paid_tier', source='user_action')
-    
     flash('Successfully upgraded to Paid Tier!', 'success')
     return redirect(url_for('main.settings'))
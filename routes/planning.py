@@ -1,21 +1,212 @@
 """
 AI-powered activity planning routes using OpenAI GPT.
 """
+import hashlib
 import json
-import re
-from datetime import datetime, timedelta
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 
+import google.auth.transport.requests
+from google.auth.exceptions import RefreshError
+import pytz
+import requests
 from flask import Blueprint, render_template, request, jsonify
 from flask_login import login_required, current_user
 from openai import OpenAI
+from requests.adapters import HTTPAdapter
+from sqlalchemy import update
 
 from config import config
-from models import db, Activity, Appointment
-from utils.helpers import get_weather_forecast
+from models import db, Activity, Appointment, User, TIER_ADMIN, TIER_FREE, TIER_PAID
+from utils.helpers import get_planning_context, get_weather_forecast
+from utils.logging_config import get_logger
 
 planning_bp = Blueprint('planning', __name__)
+logger = get_logger(__name__)
 
-openai_client = OpenAI(api_key=config.OPENAI_API_KEY) if config.OPENAI_API_KEY else None
+# Plan generation is a single long completion; cap how long it can pin a request
+# thread (the SDK default is 10 minutes) and retry transient failures once
+OPENAI_TIMEOUT = 90
+openai_client = OpenAI(
+    api_key=config.OPENAI_API_KEY,
+    timeout=OPENAI_TIMEOUT,
+    max_retries=1
+) if config.OPENAI_API_KEY else None
+
+# Plans recently generated per (user id, prompt digest): {key: (expires_at, response body)}.
+# An identical prompt (same inputs, same minute) is answered from here without another completion
+PLAN_CACHE_TTL = 3600
+_PLAN_CACHE_MAX = 1024
+_PLAN_CACHE: dict = {}
+_PLAN_CACHE_LOCK = threading.Lock()
+
+# A week of plan JSON is ~700 tokens; leave headroom without reserving the old 3000
+PLAN_MODEL = 'gpt-4o'
+PLAN_MODEL_SIMPLE = 'gpt-4o-mini'
+PLAN_MAX_TOKENS = 1200
+PLAN_MAX_TOKENS_MULTIPLE = 2000
+
+# Weekly plan generations per subscription tier
+FREE_TIER_WEEKLY_PLANS = 3
+_TIER_LIMITS = {
+    TIER_FREE: FREE_TIER_WEEKLY_PLANS,
+    TIER_PAID: math.inf,  # Unlimited for paid users
+    TIER_ADMIN: math.inf  # Unlimited
+}
+
+# Markdown code fence openers the model may wrap around its JSON, longest first
+_FENCE_OPENERS = ('```json', '```')
+
+# Open-Meteo WMO weather codes that carry a precipitation type worth calling out
+_PRECIP_TYPE_BY_CODE = {
+    95: 'thunderstorm',
+    **dict.fromkeys((96, 99), 'thunderstorm with hail'),
+    **dict.fromkeys((71, 73, 75, 77, 85, 86), 'snow'),
+    **dict.fromkeys((56, 57, 66, 67), 'freezing rain'),
+    **dict.fromkeys((51, 53, 55, 61, 63, 65, 80, 81, 82), 'rain'),
+}
+
+# IANA timezone names resolved for user locations
+_LOCATION_TIMEZONES_MAX = 4096
+_LOCATION_TIMEZONES: dict = {}
+
+# Exported-event listings shared by the conflict check and the export that follows:
+# {(user_id, time_min, time_max): (expires_at, events)}
+EXISTING_EVENTS_TTL = 60
+_EXISTING_EVENTS_MAX = 1024
+_EXISTING_EVENTS: dict = {}
+_EXISTING_EVENTS_LOCK = threading.Lock()
+
+# Refresh Google access tokens this many seconds before they expire
+TOKEN_REFRESH_LEEWAY = 300
+
+# Uncached location timezone lookups run here while the export refreshes its token
+_TIMEZONE_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix='calendar-timezone')
+
+# Token refreshes share one pooled session so repeat refreshes reuse the TLS connection
+_AUTH_SESSION = requests.Session()
+_AUTH_SESSION.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=20))
+_AUTH_REQUEST = google.auth.transport.requests.Request(session=_AUTH_SESSION)
+
+# Most requests Google accepts in one Calendar API batch
+CALENDAR_BATCH_LIMIT = 50
+
+# Attempts per calendar write; rate-limited (429, 403 rateLimitExceeded) and 5xx
+# responses are retried with exponential backoff
+CALENDAR_MAX_ATTEMPTS = 4
+# Largest page the events list endpoint returns; later pages are followed via nextPageToken
+CALENDAR_LIST_PAGE_SIZE = 2500
+_RETRYABLE_CALENDAR_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# Instructions identical for every plan request. Kept byte-stable and ahead of the
+# per-user prompt so OpenAI's automatic prompt caching can reuse the prefix.
+_SYSTEM_PROMPT = """You are an expert fitness and wellness planning assistant specializing in personalized activity scheduling.
+
+CORE COMPETENCIES:
+- Exercise science and recovery optimization
+- Weather-based activity planning
+- Time management and scheduling logic
+- Biometric data interpretation (readiness/sleep scores)
+
+OUTPUT REQUIREMENTS:
+- Always return pure JSON (no markdown, no code blocks, no explanations)
+- Follow exact date key format provided in prompt
+- Apply logical reasoning for activity timing and intensity
+- Consider all constraints (appointments, weather, daylight, fitness levels)
+
+DECISION PRINCIPLES:
+- Safety first (weather conditions, recovery needs, daylight requirements)
+- Respect user preferences (time/day preferences, activity types)
+- Balance variety with consistency
+- Optimize for long-term adherence and enjoyment
+- consider the users preferences and constraints when generating the plan
+
+TASK: Create a balanced 7-day activity schedule optimized for the user's preferences, fitness level, and environmental conditions.
+
+CRITICAL SCHEDULING RULES:
+1. **Date-Specific Context**:
+   - TODAY is the first date key in the request, at the current time given there
+   - If readiness/sleep scores provided, apply ONLY to today
+   - For today's activities: respect current time (if evening, schedule evening activities; if morning, schedule morning activities)
+   - Future days (days 2-7): plan based on preferences and weather only
+
+2. **Appointment Conflicts** (MUST FOLLOW):
+   - Work activities around any listed appointments
+   - NEVER schedule activities that overlap with appointments
+   - Leave buffer time before/after appointments
+   - If appointment time unknown, assume morning slot unavailable
+
+3. **Daylight Requirements** (MUST FOLLOW):
+   - Outdoor activities requiring visibility MUST occur between sunrise and sunset
+   - Examples requiring daylight: running, cycling, hiking, outdoor sports, photography
+   - Indoor activities have no time restrictions
+
+4. **Activity Distribution**:
+   - Spread intensity levels across the week (no back-to-back high-intensity)
+   - Honor preferred days/times when specified
+   - Keep in mind recovery needs of different muscle groups and activity types to avoid overtraining any specific body part.
+   - Match activities to optimal weather conditions
+   - Try to keep the users preferred activity in mind when generating the plan.
+   - Follow the request's instruction on how many activities to schedule per day
+   - If a last completed activity is given, plan for proper recovery and variety after it
+
+5. **Weather Optimization**:
+   - Schedule weather-dependent activities on best forecast days
+   - Reserve backup indoor activities for poor weather days
+   - Consider precipitation AND temperature for outdoor activities
+
+6. **Injuries and Pains** (when listed):
+   - Avoid activities that could aggravate these conditions
+   - Suggest modifications, lower intensity alternatives, or rest when appropriate
+   - Prioritize recovery and safety
+
+WEATHER GUIDANCE (when a forecast is provided):
+- Consider sunrise/sunset times for outdoor activities that require daylight. Schedule outdoor activities during daylight hours only.
+- PRECIPITATION: Use actual precipitation amounts (rain/snow) to assess severity, not just percentages:
+  - Light rain (<0.5cm or <0.2in): Most outdoor activities acceptable with proper gear
+  - Moderate rain (0.5-1.5cm or 0.2-0.6in): Consider activity type; running/cycling challenging but manageable
+  - Heavy rain (>1.5cm or >0.6in): Strongly prefer indoor alternatives
+  - Light snow (0.2-2cm or 0.1-0.8in): Avoid outdoor cycling and running on most surfaces; suggest winter-specific or indoor activities
+  - Heavy snow (>2cm or >0.8in): Indoor activities only
+- If ground is wet or snowy, or if near-term rain/snow is expected (next 3h > 0), mark outdoor skateboarding/board sports as unsuitable and propose indoor alternatives (e.g., strength, mobility, stationary cardio).
+- SNOW: During snow conditions (any measurable snowfall), avoid outdoor cycling, running, and activities requiring dry ground. Suggest indoor workouts or winter-specific activities like indoor training.
+- THUNDERSTORMS: If thunderstorms are forecast, absolutely avoid ALL outdoor activities during that time. Prioritize safety and schedule indoor alternatives only.
+- WIND: If wind >= 15mph or gusts >= 25mph, avoid cycling, running on exposed routes, and outdoor activities affected by wind. Suggest indoor alternatives or sheltered locations.
+- CLOUDS: High cloud cover (>80%) may reduce visibility and sunlight for outdoor activities like photography. Clear skies (<20%) are ideal for stargazing and outdoor photography.
+
+BIOMETRIC DATA (when provided):
+- Readiness and sleep scores are ONLY for today. For future days, plan activities normally based on weather and activity preferences, as there is no readiness data for those days yet.
+
+DECISION FRAMEWORK:
+- FOR TODAY: Readiness score → Intensity level → Time of day → Activity selection
+- FOR FUTURE DAYS: Weather forecast → Activity dependencies → Time preferences → Schedule
+
+OUTPUT FORMAT:
+Return a valid JSON object with the EXACT date keys listed in the request, each mapping to:
+{"day_name": "Day name", "activity": "Activity name or Rest", "time": "HH:MM", "duration_minutes": 60, "notes": "Brief explanation"}
+
+FIELD SPECIFICATIONS:
+- "day_name": Use provided day names exactly as shown in the prompt
+- "activity": Activity name from user's list, or "Rest" for recovery days
+- "time": 24-hour format (HH:MM) based on:
+  * Activity's preferred time if specified
+  * Current time for today (schedule after current time)
+  * Daylight hours for outdoor activities
+  * Optimal time for activity type (e.g., running early morning, yoga evening)
+- "duration_minutes": Integer based on activity's typical duration (default to activity duration if specified)
+- "notes": 1-2 sentences explaining why this activity fits today (weather, recovery, timing)
+
+RESPONSE REQUIREMENTS:
+1. Return ONLY valid JSON - no markdown, no explanations, no code blocks
+2. Use exact date keys provided in the prompt
+3. Every date must have an entry (use "Rest" for recovery days)
+4. Ensure all times are logical and follow daylight/appointment constraints
+5. Notes should reference specific factors (weather, readiness, time of day)"""
 
 
 @planning_bp.route('/plan', methods=['GET', 'POST'])
@@ -38,20 +229,14 @@ def plan():
             db.session.commit()
     
     activities = Activity.query.filter_by(user_id=current_user.id).all()
-    weather_forecast = None
-    
-    if current_user.location:
-        temp_unit = current_user.temperature_unit or 'C'
-        weather_data = get_weather_forecast(current_user.location, temp_unit)
-        if weather_data:
-            weather_forecast = weather_data.get('forecast')
+    weather_forecast = get_planning_context(current_user)[0]
     
     # Load persisted schedule if available
     last_schedule = None
     last_schedule_date = None
     if current_user.last_generated_schedule:
         try:
-            last_schedule = json.loads(current_user.last_generated_schedule)
+            last_schedule = _parse_schedule(current_user.last_generated_schedule)
             last_schedule_date = current_user.last_schedule_date.isoformat() if current_user.last_schedule_date else None
         except (json.JSONDecodeError, TypeError):
             last_schedule = None
@@ -66,6 +251,32 @@ def plan():
                            additional_information=current_user.additional_information or '')
 
 
+@lru_cache(maxsize=512)
+def _parse_schedule(raw):
+    """Parse a stored schedule; keyed by the raw string so a new plan misses the cache.
+    
+    The returned dict is shared between callers and must not be mutated.
+    """
+    return json.loads(raw)
+
+
+def _strip_code_fence(text):
+    """Strip surrounding whitespace and a wrapping markdown code fence from model output."""
+    text = text.strip()
+    for opener in _FENCE_OPENERS:
+        if text.startswith(opener):
+            text = text[len(opener):].lstrip()
+            break
+    if text.endswith('```'):
+        text = text[:-3].rstrip()
+    return text
+
+
+def _dump_schedule(schedule):
+    """Serialize a schedule for storage without the default whitespace."""
+    return json.dumps(schedule, separators=(',', ':'))
+
+
 @planning_bp.route('/debug/weather')
 @login_required
 def debug_weather():
@@ -118,48 +329,25 @@ def update_manual_scores():
 @login_required
 def generate_plan():
     """Generate an AI-powered weekly activity plan."""
-    from datetime import date
-    
-    # Check subscription tier limits
     today = date.today()
+    reset_due = current_user.plan_generation_reset_date is None or current_user.plan_generation_reset_date < today
     
-    # Reset weekly counter if needed (resets every Monday)
-    if current_user.plan_generation_reset_date is None or current_user.plan_generation_reset_date < today:
-        # Find next Monday (or today if it's Monday)
-        days_until_monday = (7 - today.weekday()) % 7
-        if days_until_monday == 0 and current_user.plan_generation_reset_date != today:
-            days_until_monday = 7
-        next_reset = today + timedelta(days=days_until_monday if days_until_monday > 0 else 7)
-        current_user.plan_generation_reset_date = next_reset
-        current_user.plan_generations_count = 0
-        db.session.commit()
-    
-    # Check tier-based limits
-    tier_limits = {
-        'free_tier': 3,
-        'paid_tier': float('inf'),  # Unlimited for paid users
-        'admin': float('inf')  # Unlimited
-    }
-    
-    user_tier = current_user.subscription_tier or 'free_tier'
-    limit = tier_limits.get(user_tier, 3)
+    # Profile changes are collected here and written in one transaction with the plan
+    user_updates = {}
     
-    if current_user.plan_generations_count >= limit:
-        days_until_reset = (current_user.plan_generation_reset_date - today).days
-        return jsonify({
-            'error': f'You have reached your weekly limit of {int(limit)} plan generations. Your limit resets in {days_until_reset} day(s). Consider upgrading to paid tier for unlimited generations!',
-            'limit_reached': True,
-            'current_tier': user_tier,
-            'generations_used': current_user.plan_generations_count,
-            'limit': int(limit) if limit != float('inf') else 'unlimited',
-            'reset_date': current_user.plan_generation_reset_date.isoformat()
-        }), 429
+    # Reset weekly counter if needed (resets every Monday)
+    if reset_due:
+        user_updates['plan_generation_reset_date'] = _next_monday(today)
+        user_updates['plan_generations_count'] = 0
     
+    # Load all planning rows up front so both queries share one transaction and connection checkout
     activities = Activity.query.filter_by(user_id=current_user.id).all()
     
     if not activities:
         return jsonify({'error': 'Please add some activities first!'}), 400
     
+    appointments = Appointment.query.filter_by(user_id=current_user.id).all()
+    
     # Get extra info from request
     try:
         request_data = request.get_json() or {}
@@ -170,13 +358,13 @@ def generate_plan():
         excluded_activity_ids = request_data.get('excluded_activity_ids', [])
         
         # Save these values to user profile for persistence
-        current_user.last_completed_activity = last_activity if last_activity else None
-        current_user.current_injuries = injuries_pains if injuries_pains else None
-        current_user.additional_information = extra_info if extra_info else None
-        db.session.commit()
+        user_updates['last_completed_activity'] = last_activity if last_activity else None
+        user_updates['current_injuries'] = injuries_pains if injuries_pains else None
+        user_updates['additional_information'] = extra_info if extra_info else None
         
     except (TypeError, AttributeError, KeyError):
         extra_info = ''
+        last_activity = ''
         injuries_pains = ''
         allow_multiple = False
         excluded_activity_ids = []
@@ -185,28 +373,11 @@ def generate_plan():
     if excluded_activity_ids:
         activities = [a for a in activities if a.id not in excluded_activity_ids]
         if not activities:
+            _save_user_updates(current_user.id, user_updates)
             return jsonify({'error': 'Please include at least one activity in your plan!'}), 400
     
-    # Get weather forecast and timezone
-    weather_forecast = None
-    location_timezone = None
-    if current_user.location:
-        temp_unit = current_user.temperature_unit or 'C'
-        weather_data = get_weather_forecast(current_user.location, temp_unit)
-        if weather_data:
-            weather_forecast = weather_data.get('forecast')
-            location_timezone = weather_data.get('timezone')
-    
-    # Get current date and time (use location timezone if available)
-    if location_timezone:
-        try:
-            import pytz
-            tz = pytz.timezone(location_timezone)
-            now = datetime.now(tz)
-        except (ImportError, pytz.exceptions.UnknownTimeZoneError):
-            now = datetime.now()
-    else:
-        now = datetime.now()
+    # Weather forecast and current time (in the location's timezone if available)
+    weather_forecast, _, now, _ = get_planning_context(current_user)
     
     current_date = now.strftime('%A, %B %d, %Y')
     current_time = now.strftime('%I:%M %p')
@@ -228,104 +399,190 @@ def generate_plan():
             readiness_score = current_user.manual_readiness_score
             sleep_score = current_user.manual_sleep_score
     
+    # Expand appointments once; the prompt and the conflict check share the occurrences
+    expanded_appointments = _expand_appointments(appointments, now)
+    
+    date_keys = _planning_date_keys(now)
+    
     # Build prompt
     prompt = _build_planning_prompt(
-        activities, now, current_date, current_time, 
+        activities, expanded_appointments, date_keys, current_date, current_time, 
         weather_forecast, readiness_score, sleep_score, extra_info, last_activity, allow_multiple, injuries_pains
     )
     
-    try:
-        if not openai_client:
-            # Return mock response if no API key
-            return jsonify(_generate_mock_plan(activities, now, weather_forecast))
-        
-        # Make OpenAI API call with optimized parameters
-        # Use gpt-4o for reliable JSON generation
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": """You are an expert fitness and wellness planning assistant specializing in personalized activity scheduling.
-
-CORE COMPETENCIES:
-- Exercise science and recovery optimization
-- Weather-based activity planning
-- Time management and scheduling logic
-- Biometric data interpretation (readiness/sleep scores)
+    # A repeated click with unchanged inputs gets the plan that was just generated,
+    # without another completion; it is checked ahead of the limit because it
+    # doesn't count against it
+    cache_key = (current_user.id, hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).hexdigest())
+    with _PLAN_CACHE_LOCK:
+        cached = _PLAN_CACHE.get(cache_key)
+    if cached and cached[0] > time.monotonic():
+        _save_user_updates(current_user.id, user_updates)
+        return jsonify({**cached[1], 'cached': True})
+    
+    # Check subscription tier limits; only completions are counted, and a pending
+    # Monday reset means the user cannot be over the limit
+    user_tier = current_user.subscription_tier or TIER_FREE
+    limit = _TIER_LIMITS.get(user_tier, FREE_TIER_WEEKLY_PLANS)
+    
+    if not reset_due and current_user.plan_generations_count >= limit:
+        _save_user_updates(current_user.id, user_updates)
+        days_until_reset = (current_user.plan_generation_reset_date - today).days
+        return jsonify({
+            'error': f'You have reached your weekly limit of {int(limit)} plan generations. Your limit resets in {days_until_reset} day(s). Consider upgrading to paid tier for unlimited generations!',
+            'limit_reached': True,
+            'current_tier': user_tier,
+            'generations_used': current_user.plan_generations_count,
+            'limit': int(limit) if limit != math.inf else 'unlimited',
+            'reset_date': current_user.plan_generation_reset_date.isoformat()
+        }), 429
+    
+    if not openai_client:
+        # Return mock response if no API key
+        for name, value in user_updates.items():
+            setattr(current_user, name, value)
+        db.session.commit()
+        return jsonify(_generate_mock_plan(activities, date_keys, weather_forecast))
+    
+    # Few constraints to balance means the smaller model plans just as well
+    complexity = (bool(expanded_appointments) + bool(injuries_pains)
+                  + bool(weather_forecast) + bool(allow_multiple))
+    completion_params = _plan_completion_params(prompt, simple=complexity <= 1, allow_multiple=allow_multiple)
+    
+    body, status_code = _complete_plan(cache_key, user_updates, completion_params, expanded_appointments)
+    return jsonify(body), status_code
 
-OUTPUT REQUIREMENTS:
-- Always return pure JSON (no markdown, no code blocks, no explanations)
-- Follow exact date key format provided in prompt
-- Apply logical reasoning for activity timing and intensity
-- Consider all constraints (appointments, weather, daylight, fitness levels)
 
-DECISION PRINCIPLES:
-- Safety first (weather conditions, recovery needs, daylight requirements)
-- Respect user preferences (time/day preferences, activity types)
-- Balance variety with consistency
-- Optimize for long-term adherence and enjoyment
-- consider the users preferences and constraints when generating the plan"""
-                },
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=3000,
-            temperature=0.4,
-            response_format={"type": "json_object"}
-        )
+def _complete_plan(cache_key, user_updates, completion_params, expanded_appointments):
+    """Call OpenAI for a plan and persist it with the pending profile changes.
+    
+    Returns: (response body, status code)
+    """
+    user_id = cache_key[0]
+    try:
+        response = openai_client.chat.completions.create(**completion_params)
         
         plan_text = response.choices[0].message.content
         
         # Handle empty response
         if not plan_text or not plan_text.strip():
-            print("OpenAI returned empty content")
-            return jsonify({'error': 'AI returned empty response. Please try again.'}), 500
+            logger.warning("[Plan] OpenAI returned empty content")
+            _save_user_updates(user_id, user_updates)
+            return {'error': 'AI returned empty response. Please try again.'}, 500
         
         # Try to parse as JSON
         try:
-            # Remove markdown code blocks if present
-            cleaned_text = re.sub(r'^```(?:json)?\s*\n', '', plan_text, flags=re.MULTILINE)
-            cleaned_text = re.sub(r'\n```\s*$', '', cleaned_text, flags=re.MULTILINE)
-            cleaned_text = cleaned_text.strip()
+            # Remove markdown code blocks if present (JSON mode normally omits them)
+            cleaned_text = _strip_code_fence(plan_text)
             
             plan_json = json.loads(cleaned_text)
             
             # Validate and fix conflicts with appointments
-            plan_json, conflicts_removed = _validate_and_fix_conflicts(plan_json, now)
-            
-            # Increment generation counter on successful plan creation
-            current_user.plan_generations_count += 1
-            
-            # Save the generated schedule for persistence
-            current_user.last_generated_schedule = json.dumps(plan_json)
-            current_user.last_schedule_date = datetime.now()
-            db.session.commit()
+            plan_json, conflicts_removed = _validate_and_fix_conflicts(plan_json, expanded_appointments)
             
+            schedule = plan_json
             response_data = {'plan': plan_json, 'structured': True}
             if conflicts_removed:
                 response_data['conflicts_removed'] = conflicts_removed
                 response_data['warning'] = f"Note: {len(conflicts_removed)} activity/activities were automatically changed to 'Rest' due to conflicts with your appointments."
-            
-            return jsonify(response_data)
         except Exception as e:
-            print(f"JSON parsing error: {e}")
-            print(f"Plan text: {plan_text}")
+            logger.warning("[Plan] JSON parsing error: %s", e)
+            logger.debug("[Plan] Plan text: %s", plan_text)
             # If not JSON, return as text
-            # Still increment counter as plan was generated
-            current_user.plan_generations_count += 1
-            
-            # Save the text-based schedule for persistence
-            current_user.last_generated_schedule = json.dumps({'text': plan_text})
-            current_user.last_schedule_date = datetime.now()
-            db.session.commit()
-            
-            return jsonify({'plan': plan_text, 'structured': False})
-    
+            schedule = {'text': plan_text}
+            response_data = {'plan': plan_text, 'structured': False}
+        
+        # Count the generation (from a pending weekly reset if any) and save the schedule
+        generations = user_updates.get('plan_generations_count', User.plan_generations_count) + 1
+        db.session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                **user_updates,
+                plan_generations_count=generations,
+                last_generated_schedule=_dump_schedule(schedule),
+                last_schedule_date=datetime.now()
+            )
+        )
+        db.session.commit()
+        
+        with _PLAN_CACHE_LOCK:
+            if len(_PLAN_CACHE) >= _PLAN_CACHE_MAX:
+                _PLAN_CACHE.clear()
+            _PLAN_CACHE[cache_key] = (time.monotonic() + PLAN_CACHE_TTL, response_data)
+        return response_data, 200
     except Exception as e:
-        return jsonify({'error': f'Error generating plan: {str(e)}'}), 500
+        db.session.rollback()
+        _save_user_updates(user_id, user_updates)
+        return {'error': f'Error generating plan: {str(e)}'}, 500
+
+
+def _save_user_updates(user_id, user_updates):
+    """Write the collected profile changes when no plan is saved with them.
+    
+    Keeps the planning form prefilled on the next visit even though this
+    attempt produced no plan.
+    """
+    if not user_updates:
+        return
+    try:
+        db.session.execute(update(User).where(User.id == user_id).values(**user_updates))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception("[Plan] Failed to save planning inputs for user %s", user_id)
 
 
-def _validate_and_fix_conflicts(plan_json, now):
+def _plan_completion_params(prompt, simple=False, allow_multiple=False):
+    """Build the chat completion request body for a planning prompt.
+    
+    Simple plans go to the smaller model, and the output budget only grows
+    for multi-activity days.
+    """
+    # Use gpt-4o for reliable JSON generation when the plan has real constraints
+    return {
+        'model': PLAN_MODEL_SIMPLE if simple else PLAN_MODEL,
+        'messages': [
+            {
+                "role": "system", 
+                "content": _SYSTEM_PROMPT
+            },
+            {"role": "user", "content": prompt}
+        ],
+        'max_tokens': PLAN_MAX_TOKENS_MULTIPLE if allow_multiple else PLAN_MAX_TOKENS,
+        'temperature': 0.4,
+        'response_format': {'type': 'json_object'}
+    }
+
+
+def _next_monday(today):
+    """Return the first Monday strictly after today, when the weekly plan count resets."""
+    return today + timedelta(days=(7 - today.weekday()) % 7 or 7)
+
+
+def _planning_date_keys(now):
+    """Return (YYYY-MM-DD, day name) pairs for the 7 days starting at now."""
+    date_keys = []
+    for i in range(7):
+        day = now + timedelta(days=i)
+        date_keys.append((day.strftime('%Y-%m-%d'), day.strftime('%A, %b %d')))
+    return date_keys
+
+
+def _expand_appointments(appointments, now):
+    """Expand appointments into their occurrences over the 7-day planning window.
+    
+    Returns: list of occurrence dicts sorted by date and time
+    """
+    end_date = (now + timedelta(days=6)).date()
+    expanded_appointments = []
+    for apt in appointments:
+        expanded_appointments.extend(apt.get_occurrences(now.date(), end_date))
+    expanded_appointments.sort(key=lambda x: (x['date'], x['time'] if x['time'] else datetime.min.time()))
+    return expanded_appointments
+
+
+def _validate_and_fix_conflicts(plan_json, expanded_appointments):
     """
     Validate that planned activities don't conflict with appointments.
     If conflicts are found, change the activity to 'Rest' and add a warning note.
@@ -334,16 +591,6 @@ def _validate_and_fix_conflicts(plan_json, now):
     """
     conflicts_removed = []
     
-    # Get appointments for the next 7 days
-    end_date = (now + timedelta(days=6)).date()
-    all_appointments = Appointment.query.filter_by(user_id=current_user.id).all()
-    
-    # Expand all appointments into occurrences
-    expanded_appointments = []
-    for apt in all_appointments:
-        occurrences = apt.get_occurrences(now.date(), end_date)
-        expanded_appointments.extend(occurrences)
-    
     # Create a map of date -> list of appointments
     appointments_by_date = {}
     for apt in expanded_appointments:
@@ -421,92 +668,67 @@ def _validate_and_fix_conflicts(plan_json, now):
     return plan_json, conflicts_removed
 
 
-def _build_planning_prompt(activities, now, current_date, current_time, 
+def _build_planning_prompt(activities, expanded_appointments, date_keys, current_date, current_time, 
                            weather_forecast, readiness_score, sleep_score, extra_info, last_activity, allow_multiple=False, injuries_pains=''):
     """Build the comprehensive prompt for OpenAI."""
-    # Prepare activity information
-    activity_info = []
-    for activity in activities:
-        info = f"- {activity.name}"
+    # Build prompt as a list of chunks joined once at the end
+    parts = [f"""Current Date & Time: {current_date} at {current_time}
+
+Please create a detailed weekly activity plan for someone who enjoys the following activities:
+
+"""]
+    
+    # Prepare activity information, one line per activity
+    for index, activity in enumerate(activities):
+        if index:
+            parts.append("\n")
+        parts.append(f"- {activity.name}")
         if activity.duration_minutes:
-            info += f" (Duration: {activity.duration_minutes} min)"
+            parts.append(f" (Duration: {activity.duration_minutes} min)")
         if activity.intensity:
-            info += f" (Intensity: {activity.intensity})"
+            parts.append(f" (Intensity: {activity.intensity})")
         if activity.location:
-            info += f" (Location: {activity.location})"
+            parts.append(f" (Location: {activity.location})")
         if activity.preferred_time:
-            info += f" (Preferred Time: {activity.preferred_time})"
+            parts.append(f" (Preferred Time: {activity.preferred_time})")
         if activity.preferred_days:
-            info += f" (Preferred Days: {activity.preferred_days})"
+            parts.append(f" (Preferred Days: {activity.preferred_days})")
         if activity.dependencies:
-            info += f" (Dependencies: {activity.dependencies})"
+            parts.append(f" (Dependencies: {activity.dependencies})")
         if activity.description:
-            info += f" - {activity.description}"
-        activity_info.append(info)
-    
-    # Get appointments for the next 7 days using expanded occurrences
-    end_date = (now + timedelta(days=6)).date()
-    
-    # Get all user appointments and expand repeating ones
-    all_appointments = Appointment.query.filter_by(user_id=current_user.id).all()
-    expanded_appointments = []
-    for apt in all_appointments:
-        occurrences = apt.get_occurrences(now.date(), end_date)
-        expanded_appointments.extend(occurrences)
-    
-    # Sort by date
-    expanded_appointments.sort(key=lambda x: (x['date'], x['time'] if x['time'] else datetime.min.time()))
-    
-    # Generate date keys for the next 7 days
-    date_keys = []
-    for i in range(7):
-        date = now + timedelta(days=i)
-        date_key = date.strftime('%Y-%m-%d')
-        day_name = date.strftime('%A, %b %d')
-        date_keys.append((date_key, day_name))
-    
-    # Build prompt
-    prompt = f"""Current Date & Time: {current_date} at {current_time}
-
-Please create a detailed weekly activity plan for someone who enjoys the following activities:
-
-{chr(10).join(activity_info)}
-
-"""
+            parts.append(f" - {activity.description}")
+    parts.append("\n\n")
     
     # Add appointments
     if expanded_appointments:
-        prompt += "\nScheduled Appointments & Responsibilities:\n"
+        parts.append("\nScheduled Appointments & Responsibilities:\n")
         for apt in expanded_appointments:
             apt_date = apt['date'].strftime('%A, %b %d (%Y-%m-%d)')
-            apt_info = f"- {apt['title']} ({apt['appointment_type']}) on {apt_date}"
+            parts.append(f"- {apt['title']} ({apt['appointment_type']}) on {apt_date}")
             if apt['time']:
-                apt_info += f" at {apt['time'].strftime('%I:%M %p')}"
+                parts.append(f" at {apt['time'].strftime('%I:%M %p')}")
             if apt['duration_minutes']:
-                apt_info += f" ({apt['duration_minutes']} min)"
+                parts.append(f" ({apt['duration_minutes']} min)")
             if apt['description']:
-                apt_info += f" - {apt['description']}"
-            prompt += apt_info + "\n"
-        prompt += "\nIMPORTANT: Work activities around these appointments. Do NOT schedule conflicting activities.\n"
+                parts.append(f" - {apt['description']}")
+            parts.append("\n")
     
     # Add last activity information
     if last_activity:
-        prompt += f"\nLast Activity Completed:\n{last_activity}\n"
-        prompt += "Consider this when planning to ensure proper recovery and variety.\n"
+        parts.append(f"\nLast Activity Completed:\n{last_activity}\n")
     
     # Add injuries/pains information
     if injuries_pains:
-        prompt += f"\n⚠️ CURRENT INJURIES OR PAINS:\n{injuries_pains}\n"
-        prompt += "CRITICAL: Avoid activities that could aggravate these conditions. Suggest modifications, lower intensity alternatives, or rest when appropriate. Prioritize recovery and safety.\n"
+        parts.append(f"\n⚠️ CURRENT INJURIES OR PAINS:\n{injuries_pains}\n")
     
     # Add extra information
     if extra_info:
-        prompt += f"\nAdditional Context:\n{extra_info}\n"
+        parts.append(f"\nAdditional Context:\n{extra_info}\n")
     
     # Add weather information and surface condition guidance
     if weather_forecast:
         temp_unit_display = current_user.temperature_unit or 'C'
-        prompt += f"\nWeather forecast for {current_user.location} (with daylight hours):\n"
+        parts.append(f"\nWeather forecast for {current_user.location} (with daylight hours):\n")
         for day in weather_forecast:
             # Include ground condition hints for planning
             wet = day.get('is_wet_ground')
@@ -523,17 +745,7 @@ Please create a detailed weekly activity plan for someone who enjoys the followi
             precip_unit = day.get('precip_unit', 'cm')
             
             # Determine precipitation type from weathercode
-            precip_type = 'none'
-            if weathercode in [95]:
-                precip_type = 'thunderstorm'
-            elif weathercode in [96, 99]:
-                precip_type = 'thunderstorm with hail'
-            elif weathercode in [71, 73, 75, 77, 85, 86]:
-                precip_type = 'snow'
-            elif weathercode in [56, 57, 66, 67]:
-                precip_type = 'freezing rain'
-            elif weathercode in [51, 53, 55, 61, 63, 65, 80, 81, 82]:
-                precip_type = 'rain'
+            precip_type = _PRECIP_TYPE_BY_CODE.get(weathercode, 'none')
             
             short_term = ''
             if day.get('is_today'):
@@ -564,132 +776,61 @@ Please create a detailed weekly activity plan for someone who enjoys the followi
                 precip_parts.append(f"({precip_type})")
             precip_info = "Precipitation: " + ", ".join(precip_parts)
             
-            prompt += f"- {day['date_short']}: {day['temp_max']}°{temp_unit_display}, {precip_info}, Cloud: {cloud_cover}%, Wind: {wind_speed}mph{short_term}, "
-            prompt += f"Sunrise: {day['sunrise']}, Sunset: {day['sunset']}{surface_note}\n"
-        prompt += "\nIMPORTANT: Consider sunrise/sunset times for outdoor activities that require daylight. Schedule outdoor activities during daylight hours only.\n"
-        prompt += "PRECIPITATION GUIDANCE: Use actual precipitation amounts (rain/snow) to assess severity, not just percentages:\n"
-        prompt += "  - Light rain (<0.5cm or <0.2in): Most outdoor activities acceptable with proper gear\n"
-        prompt += "  - Moderate rain (0.5-1.5cm or 0.2-0.6in): Consider activity type; running/cycling challenging but manageable\n"
-        prompt += "  - Heavy rain (>1.5cm or >0.6in): Strongly prefer indoor alternatives\n"
-        prompt += "  - Light snow (0.2-2cm or 0.1-0.8in): Avoid outdoor cycling and running on most surfaces; suggest winter-specific or indoor activities\n"
-        prompt += "  - Heavy snow (>2cm or >0.8in): Indoor activities only\n"
-        prompt += "If ground is wet or snowy, or if near-term rain/snow is expected (next 3h > 0), mark outdoor skateboarding/board sports as unsuitable and propose indoor alternatives (e.g., strength, mobility, stationary cardio).\n"
-        prompt += "SNOW GUIDANCE: During snow conditions (any measurable snowfall), avoid outdoor cycling, running, and activities requiring dry ground. Suggest indoor workouts or winter-specific activities like indoor training.\n"
-        prompt += "THUNDERSTORM GUIDANCE: If thunderstorms are forecast, absolutely avoid ALL outdoor activities during that time. Prioritize safety and schedule indoor alternatives only.\n"
-        prompt += "WIND GUIDANCE: If wind >= 15mph or gusts >= 25mph, avoid cycling, running on exposed routes, and outdoor activities affected by wind. Suggest indoor alternatives or sheltered locations.\n"
-        prompt += "CLOUD GUIDANCE: High cloud cover (>80%) may reduce visibility and sunlight for outdoor activities like photography. Clear skies (<20%) are ideal for stargazing and outdoor photography.\n"
+            parts.append(f"- {day['date_short']}: {day['temp_max']}°{temp_unit_display}, {precip_info}, Cloud: {cloud_cover}%, Wind: {wind_speed}mph{short_term}, ")
+            parts.append(f"Sunrise: {day['sunrise']}, Sunset: {day['sunset']}{surface_note}\n")
     
     # Add readiness and sleep scores
     if readiness_score or sleep_score:
-        prompt += f"\nToday's Biometric Data (for {date_keys[0][1]} ONLY - do not apply to future days):\n"
+        parts.append(f"\nToday's Biometric Data (for {date_keys[0][1]} ONLY - do not apply to future days):\n")
         
         if readiness_score:
-            prompt += f"- Readiness score: {readiness_score}/100"
+            parts.append(f"- Readiness score: {readiness_score}/100")
             if readiness_score < 30:
-                prompt += " (Low - prioritize recovery with lower intensity exercises like stretching and yoga)\n"
+                parts.append(" (Low - prioritize recovery with lower intensity exercises like stretching and yoga)\n")
             elif readiness_score < 65:
-                prompt += " (Moderate - heart rate and recent sleep are about usual, body is balancing stress with recovery)\n"
+                parts.append(" (Moderate - heart rate and recent sleep are about usual, body is balancing stress with recovery)\n")
             else:
-                prompt += " (High - body is well-rested and recovered, can handle intense activities)\n"
+                parts.append(" (High - body is well-rested and recovered, can handle intense activities)\n")
         
         if sleep_score:
-            prompt += f"- Sleep score: {sleep_score}%"
+            parts.append(f"- Sleep score: {sleep_score}%")
             if sleep_score < 70:
-                prompt += " (Poor - extra rest recommended today)\n"
+                parts.append(" (Poor - extra rest recommended today)\n")
             elif sleep_score < 85:
-                prompt += " (Moderate quality)\n"
+                parts.append(" (Moderate quality)\n")
             else:
-                prompt += " (Excellent quality)\n"
-        
-        prompt += "\nIMPORTANT: These scores are ONLY for today. For future days, plan activities normally based on weather and activity preferences, as we don't have readiness data for those days yet.\n"
+                parts.append(" (Excellent quality)\n")
     
-    multiple_activities_instruction = ""
+    # The static instructions live in the system prompt so they form a stable cacheable prefix
     if allow_multiple:
-        multiple_activities_instruction = "13. User wants MULTIPLE activities per day when possible - schedule 2-3 activities per day based on time availability and recovery needs\n"
+        per_day = "User wants MULTIPLE activities per day when possible - schedule 2-3 activities per day based on time availability and recovery needs"
     else:
-        multiple_activities_instruction = "13. Schedule ONE activity per day maximum (unless user has specific appointments/responsibilities)\n"
+        per_day = "Schedule ONE activity per day maximum (unless user has specific appointments/responsibilities)"
     
-    prompt += f"""
-TASK: Create a balanced 7-day activity schedule optimized for the user's preferences, fitness level, and environmental conditions.
-
-CRITICAL SCHEDULING RULES:
-1. **Date-Specific Context**:
-   - TODAY is {date_keys[0][1]} at {current_time}
-   - If readiness/sleep scores provided, apply ONLY to today
-   - For today's activities: respect current time (if evening, schedule evening activities; if morning, schedule morning activities)
-   - Future days (days 2-7): plan based on preferences and weather only
-
-2. **Appointment Conflicts** (MUST FOLLOW):
-   - NEVER schedule activities that overlap with appointments
-   - Leave buffer time before/after appointments
-   - If appointment time unknown, assume morning slot unavailable
-
-3. **Daylight Requirements** (MUST FOLLOW):
-   - Outdoor activities requiring visibility MUST occur between sunrise and sunset
-   - Examples requiring daylight: running, cycling, hiking, outdoor sports, photography
-   - Indoor activities have no time restrictions
-
-4. **Activity Distribution**:
-   - Spread intensity levels across the week (no back-to-back high-intensity)
-   - Honor preferred days/times when specified
-   - Keep in mind recovery needs of different muscle groups and activity types to avoid overtraining any specific body part.
-   - Match activities to optimal weather conditions
-   - Try to keep the users preferred activity in mind when generating the plan.
-{multiple_activities_instruction.replace('13.', '   -')}
+    parts.append(f"""
+TODAY is {date_keys[0][1]} at {current_time}.
+Activities per day: {per_day}
 
-5. **Weather Optimization**:
-   - Schedule weather-dependent activities on best forecast days
-   - Reserve backup indoor activities for poor weather days
-   - Consider precipitation AND temperature for outdoor activities
-
-DECISION FRAMEWORK:
-- FOR TODAY: Readiness score → Intensity level → Time of day → Activity selection
-- FOR FUTURE DAYS: Weather forecast → Activity dependencies → Time preferences → Schedule
-
-OUTPUT FORMAT:
-Return a valid JSON object with date keys mapping to activity details.
 Use these EXACT date keys:
-"""
+""")
     for date_key, day_name in date_keys:
-        prompt += f'  "{date_key}": {{"day_name": "{day_name}", "activity": "Activity name or Rest", "time": "HH:MM", "duration_minutes": 60, "notes": "Brief explanation"}}\n'
+        parts.append(f'  "{date_key}": {{"day_name": "{day_name}", "activity": "Activity name or Rest", "time": "HH:MM", "duration_minutes": 60, "notes": "Brief explanation"}}\n')
     
-    prompt += """
-FIELD SPECIFICATIONS:
-- "day_name": Use provided day names exactly as shown above
-- "activity": Activity name from user's list, or "Rest" for recovery days
-- "time": 24-hour format (HH:MM) based on:
-  * Activity's preferred time if specified
-  * Current time for today (schedule after current time)
-  * Daylight hours for outdoor activities
-  * Optimal time for activity type (e.g., running early morning, yoga evening)
-- "duration_minutes": Integer based on activity's typical duration (default to activity duration if specified)
-- "notes": 1-2 sentences explaining why this activity fits today (weather, recovery, timing)
-
-RESPONSE REQUIREMENTS:
-1. Return ONLY valid JSON - no markdown, no explanations, no code blocks
-2. Use exact date keys provided above
-3. Every date must have an entry (use "Rest" for recovery days)
-4. Ensure all times are logical and follow daylight/appointment constraints
-5. Notes should reference specific factors (weather, readiness, time of day)
-
+    parts.append("""
 Begin JSON output:
-"""
+""")
     
-    return prompt
+    return ''.join(parts)
 
 
-def _generate_mock_plan(activities, now, weather_forecast):
+def _generate_mock_plan(activities, date_keys, weather_forecast):
     """Generate a mock plan when OpenAI API is not available."""
     mock_plan = {}
+    temp_unit = current_user.temperature_unit or 'C'
     
-    for i in range(7):
-        date = now + timedelta(days=i)
-        date_key = date.strftime('%Y-%m-%d')
-        day_name = date.strftime('%A, %b %d')
-        
+    for i, (date_key, day_name) in enumerate(date_keys):
         if weather_forecast and i < len(weather_forecast):
             weather = weather_forecast[i]
-            temp_unit = current_user.temperature_unit or 'C'
             if weather['precipitation'] > 60:
                 mock_plan[date_key] = {
                     "day_name": day_name,
@@ -717,6 +858,266 @@ def _generate_mock_plan(activities, now, weather_forecast):
     return {'plan': mock_plan, 'structured': True}
 
 
+@lru_cache(maxsize=256)
+def _pytz_zone(name):
+    return pytz.timezone(name)
+
+
+def _calendar_timezone(location, temperature_unit):
+    """Return (timezone name, pytz zone) for calendar events in the user's location.
+    
+    A location's timezone never changes, so successful lookups are kept for the
+    life of the process and later exports skip the weather call entirely.
+    Takes plain values rather than the user so it can run in a worker thread.
+    """
+    timezone = 'UTC'
+    if location:
+        timezone = _LOCATION_TIMEZONES.get(location)
+        if timezone is None:
+            weather_data = get_weather_forecast(location, temperature_unit or 'C')
+            timezone = weather_data.get('timezone', 'UTC') if weather_data else 'UTC'
+            if weather_data:
+                if len(_LOCATION_TIMEZONES) >= _LOCATION_TIMEZONES_MAX:
+                    _LOCATION_TIMEZONES.clear()
+                _LOCATION_TIMEZONES[location] = timezone
+    return timezone, _pytz_zone(timezone)
+
+
+def _stored_token_expiry(credentials_dict):
+    """Return the access token expiry saved with stored Google credentials, if any."""
+    expiry = credentials_dict.get('expiry')
+    return datetime.fromisoformat(expiry) if expiry else None
+
+
+def _token_needs_refresh(creds):
+    """True when the access token's expiry is unknown or within the refresh leeway."""
+    return creds.expiry is None or creds.expiry - datetime.utcnow() < timedelta(seconds=TOKEN_REFRESH_LEEWAY)
+
+
+def _credentials_json(creds):
+    """Serialize Google credentials for User.google_token, including the token expiry."""
+    return json.dumps({
+        'token': creds.token,
+        'refresh_token': creds.refresh_token,
+        'token_uri': creds.token_uri,
+        'client_id': creds.client_id,
+        'client_secret': creds.client_secret,
+        'scopes': creds.scopes,
+        'expiry': creds.expiry.isoformat() if creds.expiry else None
+    })
+
+
+def _load_google_credentials(user):
+    """Build Credentials from the user's stored Google token (JSON, or a legacy bare token)."""
+    from google.oauth2.credentials import Credentials
+    
+    # New format: JSON with scopes, parsed once per loaded user
+    credentials_dict = user.parsed_google_creds
+    if credentials_dict is not None:
+        try:
+            return Credentials(
+                token=credentials_dict.get('token'),
+                refresh_token=credentials_dict.get('refresh_token'),
+                token_uri=credentials_dict.get('token_uri', 'https://oauth2.googleapis.com/token'),
+                client_id=credentials_dict.get('client_id', config.GOOGLE_CLIENT_ID),
+                client_secret=credentials_dict.get('client_secret', config.GOOGLE_CLIENT_SECRET),
+                scopes=credentials_dict.get('scopes'),  # Use the actual scopes from the token
+                expiry=_stored_token_expiry(credentials_dict)
+            )
+        except Exception as e:
+            logger.warning("[Calendar] Error parsing credentials: %s", e)
+    
+    # Old format: just the token string (fallback for existing users)
+    return Credentials(
+        token=user.google_token,
+        refresh_token=user.google_refresh_token,
+        token_uri='https://oauth2.googleapis.com/token',
+        client_id=config.GOOGLE_CLIENT_ID,
+        client_secret=config.GOOGLE_CLIENT_SECRET,
+        scopes=config.GOOGLE_SCOPES
+    )
+
+
+@lru_cache(maxsize=1)
+def _calendar_discovery_document():
+    """The Calendar v3 discovery document bundled with the client library, read once."""
+    from googleapiclient import discovery_cache
+    
+    return discovery_cache.get_static_doc('calendar', 'v3')
+
+
+def _get_calendar_service(user):
+    """Return (creds, service) for the user's Google Calendar.
+    
+    Built per request: services and credentials are not thread-safe, so only the
+    immutable discovery document is shared between requests.
+    """
+    from googleapiclient.discovery import build_from_document
+    
+    creds = _load_google_credentials(user)
+    service = build_from_document(_calendar_discovery_document(), credentials=creds)
+    return creds, service
+
+
+def _save_refreshed_credentials(user, creds):
+    """Persist refreshed Google credentials on the user."""
+    user.google_token = _credentials_json(creds)
+    user.google_refresh_token = creds.refresh_token
+    db.session.commit()
+
+
+def _actionable_plan_days(plan_data):
+    """The plan days that export would write to the calendar (everything but rest days)."""
+    return {
+        date_key: day_data for date_key, day_data in plan_data.items()
+        if isinstance(day_data, dict) and 'rest' not in (day_data.get('activity') or '').lower()
+    }
+
+
+def _load_plan_context(user, service, tz, plan_data):
+    """List the events this app previously exported in the plan's date range.
+    
+    The listing is cached briefly so the conflict check and the export that
+    usually follows it share one call.
+    
+    Returns: dict with time_min, time_max, events, events_by_date and cache_key,
+    or None when the plan has no dates
+    """
+    # Find the first and last plan day in one pass
+    keys = iter(plan_data)
+    first_key = last_key = next(keys, None)
+    if first_key is None:
+        return None
+    for key in keys:
+        if key < first_key:
+            first_key = key
+        elif key > last_key:
+            last_key = key
+    
+    first_date = datetime.fromisoformat(first_key)
+    last_date = datetime.fromisoformat(last_key) + timedelta(days=1)
+    time_min = tz.localize(first_date).isoformat()
+    time_max = tz.localize(last_date).isoformat()
+    
+    cache_key = (user.id, time_min, time_max)
+    with _EXISTING_EVENTS_LOCK:
+        cached = _EXISTING_EVENTS.get(cache_key)
+    if cached and cached[0] > time.monotonic():
+        events = cached[1]
+    else:
+        events = []
+        page_token = None
+        while True:
+            page = service.events().list(
+                calendarId='primary',
+                timeMin=time_min,
+                timeMax=time_max,
+                privateExtendedProperty='exportedFrom=aiActivityPlanner',
+                # Exported events never recur, so there is nothing to expand
+                singleEvents=False,
+                maxResults=CALENDAR_LIST_PAGE_SIZE,
+                pageToken=page_token,
+                # Only ids (to update) and start times (to match plan days) are used
+                fields='items(id,start/dateTime,start/date),nextPageToken'
+            ).execute(num_retries=CALENDAR_MAX_ATTEMPTS - 1)
+            events.extend(page.get('items', []))
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                break
+        with _EXISTING_EVENTS_LOCK:
+            if len(_EXISTING_EVENTS) >= _EXISTING_EVENTS_MAX:
+                _EXISTING_EVENTS.clear()
+            _EXISTING_EVENTS[cache_key] = (time.monotonic() + EXISTING_EVENTS_TTL, events)
+    
+    # Map events by their local date so plan days can update them; a dateTime
+    # always begins with its own YYYY-MM-DD, so no parse is needed
+    events_by_date = {}
+    for evt in events:
+        start = evt['start']
+        if 'dateTime' in start:
+            events_by_date[start['dateTime'][:10]] = evt
+        elif 'date' in start:
+            events_by_date[start['date']] = evt
+    
+    return {
+        'time_min': time_min,
+        'time_max': time_max,
+        'events': events,
+        'events_by_date': events_by_date,
+        'cache_key': cache_key
+    }
+
+
+def _forget_existing_events(cache_key):
+    """Drop a cached event listing once an export has changed the calendar."""
+    with _EXISTING_EVENTS_LOCK:
+        _EXISTING_EVENTS.pop(cache_key, None)
+
+
+def _is_retryable_calendar_error(exception):
+    """True for Calendar API rate limiting and server errors, which are worth retrying."""
+    from googleapiclient.errors import HttpError
+    
+    if not isinstance(exception, HttpError):
+        return False
+    status = exception.resp.status
+    if status == 403:
+        # 403 is also used for permission errors; only the rate-limit reasons are transient
+        return b'ateLimitExceeded' in (exception.content or b'')
+    return status in _RETRYABLE_CALENDAR_STATUSES
+
+
+def _is_calendar_auth_error(exception):
+    """True when Google rejected the stored grant: a failed token refresh or an API 401.
+    
+    The API client refreshes an expired token on its own, so a revoked grant can
+    surface as RefreshError from any call, not only from the explicit refresh.
+    """
+    from googleapiclient.errors import HttpError
+    
+    if isinstance(exception, RefreshError):
+        return True
+    return isinstance(exception, HttpError) and exception.resp.status == 401
+
+
+def _execute_calendar_requests(service, calendar_requests, on_success):
+    """Send (request_id, request) pairs as batch requests, retrying transient failures.
+    
+    Requests that hit rate limits or server errors are re-sent in a new batch
+    with exponential backoff and jitter, up to CALENDAR_MAX_ATTEMPTS times.
+    
+    Returns: dict of request_id -> exception for requests that still failed
+    """
+    failures = {}
+    pending = list(calendar_requests)
+    for attempt in range(CALENDAR_MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(min(2 ** (attempt - 1), 30) + random.random())
+        
+        requests_by_id = dict(pending)
+        retry = []
+        
+        def _on_response(request_id, response, exception):
+            if exception is None:
+                failures.pop(request_id, None)
+                on_success(request_id, response)
+                return
+            failures[request_id] = exception
+            if _is_retryable_calendar_error(exception):
+                retry.append((request_id, requests_by_id[request_id]))
+        
+        for offset in range(0, len(pending), CALENDAR_BATCH_LIMIT):
+            batch = service.new_batch_http_request(callback=_on_response)
+            for request_id, calendar_request in pending[offset:offset + CALENDAR_BATCH_LIMIT]:
+                batch.add(calendar_request, request_id=request_id)
+            batch.execute()
+        
+        if not retry:
+            break
+        pending = retry
+    return failures
+
+
 @planning_bp.route('/check_calendar_conflicts', methods=['POST'])
 @login_required
 def check_calendar_conflicts():
@@ -728,113 +1129,70 @@ def check_calendar_conflicts():
     if not current_user.google_token:
         return jsonify({'error': 'Google account not connected.'}), 403
     
+    from googleapiclient.errors import HttpError
+    
     try:
-        from googleapiclient.discovery import build
-        from google.oauth2.credentials import Credentials
-        import pytz
-        
-        request_data = request.get_json() or {}
+        request_data = request.get_json(cache=False) or {}
         plan_data = request_data.get('plan', {})
         
         if not plan_data:
             return jsonify({'error': 'No plan data provided'}), 400
         
-        # Parse credentials (same as export function)
-        if current_user.google_token.startswith('{'):
-            credentials_dict = json.loads(current_user.google_token)
-            creds = Credentials(
-                token=credentials_dict.get('token'),
-                refresh_token=credentials_dict.get('refresh_token'),
-                token_uri=credentials_dict.get('token_uri', 'https://oauth2.googleapis.com/token'),
-                client_id=credentials_dict.get('client_id', config.GOOGLE_CLIENT_ID),
-                client_secret=credentials_dict.get('client_secret', config.GOOGLE_CLIENT_SECRET),
-                scopes=credentials_dict.get('scopes')
-            )
-        else:
-            creds = Credentials(
-                token=current_user.google_token,
-                refresh_token=current_user.google_refresh_token,
-                token_uri='https://oauth2.googleapis.com/token',
-                client_id=config.GOOGLE_CLIENT_ID,
-                client_secret=config.GOOGLE_CLIENT_SECRET,
-                scopes=config.GOOGLE_SCOPES
-            )
+        # Only days that export would write can conflict; with none, skip the API entirely
+        plan_days = _actionable_plan_days(plan_data)
+        if not plan_days:
+            return jsonify({
+                'hasConflicts': False,
+                'message': 'No plan dates to check.'
+            })
+        
+        creds, service = _get_calendar_service(current_user)
         
-        # Refresh token if needed
-        if creds.refresh_token:
+        # Refresh token if it has expired or is about to
+        if creds.refresh_token and _token_needs_refresh(creds):
             try:
-                from google.auth.transport.requests import Request
-                creds.refresh(Request())
-                credentials_dict = {
-                    'token': creds.token,
-                    'refresh_token': creds.refresh_token,
-                    'token_uri': creds.token_uri,
-                    'client_id': creds.client_id,
-                    'client_secret': creds.client_secret,
-                    'scopes': creds.scopes
-                }
-                current_user.google_token = json.dumps(credentials_dict)
-                current_user.google_refresh_token = creds.refresh_token
-                db.session.commit()
+                previous_token = creds.token
+                creds.refresh(_AUTH_REQUEST)
+                if creds.token != previous_token:
+                    _save_refreshed_credentials(current_user, creds)
             except Exception as refresh_error:
                 return jsonify({
                     'error': 'Your Google connection has expired. Please disconnect and reconnect.',
                     'reconnect_required': True
                 }), 401
         
-        # Build calendar service
-        service = build('calendar', 'v3', credentials=creds)
-        
         # Get timezone
-        timezone = 'UTC'
-        if current_user.location:
-            temp_unit = current_user.temperature_unit or 'C'
-            weather_data = get_weather_forecast(current_user.location, temp_unit)
-            if weather_data:
-                timezone = weather_data.get('timezone', 'UTC')
-        
-        tz = pytz.timezone(timezone)
+        timezone, tz = _calendar_timezone(current_user.location, current_user.temperature_unit)
         
-        # Check for existing events with our tag
-        plan_dates = list(plan_data.keys())
-        if plan_dates:
-            first_date = datetime.strptime(min(plan_dates), '%Y-%m-%d')
-            last_date = datetime.strptime(max(plan_dates), '%Y-%m-%d') + timedelta(days=1)
-            
-            time_min = tz.localize(first_date).isoformat()
-            time_max = tz.localize(last_date).isoformat()
-            
-            existing_events_result = service.events().list(
-                calendarId='primary',
-                timeMin=time_min,
-                timeMax=time_max,
-                privateExtendedProperty='exportedFrom=aiActivityPlanner',
-                singleEvents=True
-            ).execute()
-            
-            existing_tagged_events = existing_events_result.get('items', [])
-            
-            if existing_tagged_events:
-                return jsonify({
-                    'hasConflicts': True,
-                    'conflictCount': len(existing_tagged_events),
-                    'message': f'Found {len(existing_tagged_events)} event(s) previously exported from this app in the same date range.'
-                })
-            else:
-                return jsonify({
-                    'hasConflicts': False,
-                    'message': 'No conflicts found.'
-                })
-        else:
+        # Check for existing events with our tag; the export that usually follows reuses this listing
+        plan_context = _load_plan_context(current_user, service, tz, plan_days)
+        existing_tagged_events = plan_context['events']
+        if existing_tagged_events:
             return jsonify({
-                'hasConflicts': False,
-                'message': 'No plan dates to check.'
+                'hasConflicts': True,
+                'conflictCount': len(existing_tagged_events),
+                'message': f'Found {len(existing_tagged_events)} event(s) previously exported from this app in the same date range.'
             })
+        return jsonify({
+            'hasConflicts': False,
+            'message': 'No conflicts found.'
+        })
     
+    except RefreshError:
+        return jsonify({
+            'error': 'Your Google connection has expired. Please disconnect and reconnect.',
+            'reconnect_required': True
+        }), 401
+    except HttpError as e:
+        if e.resp.status == 401:
+            return jsonify({
+                'error': 'Your Google connection has expired. Please disconnect and reconnect.',
+                'reconnect_required': True
+            }), 401
+        logger.warning("[Calendar] Conflict check API error: %s", e)
+        return jsonify({'error': f'Failed to check for conflicts: {str(e)}'}), 500
     except Exception as e:
-        import traceback
-        print(f"Conflict check error: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("[Calendar] Conflict check error for user %s", current_user.id)
         return jsonify({'error': f'Failed to check for conflicts: {str(e)}'}), 500
 
 
@@ -854,169 +1212,110 @@ def export_to_google_calendar():
         return jsonify({'error': 'Google account not connected. Please connect your Google account first.'}), 403
     
     try:
-        from googleapiclient.discovery import build
         from googleapiclient.errors import HttpError
-        import pytz
         
-        request_data = request.get_json() or {}
+        # The plan is read once here, so don't keep the decoded copy on the request
+        request_data = request.get_json(cache=False) or {}
         plan_data = request_data.get('plan', {})
         
         if not plan_data:
             return jsonify({'error': 'No plan data provided'}), 400
         
-        # Parse the stored credentials
-        from google.oauth2.credentials import Credentials
+        # Rest days are never exported; a plan of only rest days needs no Calendar API calls
+        plan_days = _actionable_plan_days(plan_data)
+        if not plan_days:
+            logger.info("[Calendar] Plan has no exportable days for user %s", current_user.id)
+            return jsonify({
+                'success': False,
+                'message': 'No events were created. Your plan may only contain rest days.'
+            }), 200
         
+        # Build the Calendar API service from the bundled discovery document
         try:
-            if current_user.google_token.startswith('{'):
-                # New format: JSON with scopes
-                credentials_dict = json.loads(current_user.google_token)
-                creds = Credentials(
-                    token=credentials_dict.get('token'),
-                    refresh_token=credentials_dict.get('refresh_token'),
-                    token_uri=credentials_dict.get('token_uri', 'https://oauth2.googleapis.com/token'),
-                    client_id=credentials_dict.get('client_id', config.GOOGLE_CLIENT_ID),
-                    client_secret=credentials_dict.get('client_secret', config.GOOGLE_CLIENT_SECRET),
-                    scopes=credentials_dict.get('scopes')  # Use the actual scopes from the token
-                )
-                print(f"[Calendar] Loaded credentials from JSON with scopes: {creds.scopes}")
-            else:
-                # Old format: just the token string (fallback for existing users)
-                creds = Credentials(
-                    token=current_user.google_token,
-                    refresh_token=current_user.google_refresh_token,
-                    token_uri='https://oauth2.googleapis.com/token',
-                    client_id=config.GOOGLE_CLIENT_ID,
-                    client_secret=config.GOOGLE_CLIENT_SECRET,
-                    scopes=config.GOOGLE_SCOPES
-                )
-                print(f"[Calendar] Using legacy token format, assuming scopes: {config.GOOGLE_SCOPES}")
+            creds, service = _get_calendar_service(current_user)
+            logger.debug("[Calendar] Calendar service ready for user %s", current_user.id)
         except Exception as e:
-            print(f"[Calendar] Error parsing credentials: {e}")
-            # Fallback to old method
-            creds = Credentials(
-                token=current_user.google_token,
-                refresh_token=current_user.google_refresh_token,
-                token_uri='https://oauth2.googleapis.com/token',
-                client_id=config.GOOGLE_CLIENT_ID,
-                client_secret=config.GOOGLE_CLIENT_SECRET,
-                scopes=config.GOOGLE_SCOPES
-            )
+            logger.exception("[Calendar] Service build failed")
+            return jsonify({'error': f'Failed to connect to Google Calendar API. Please reconnect your Google account. Error: {str(e)}'}), 500
         
-        print(f"[Calendar] Token expired: {creds.expired}, Has refresh token: {bool(creds.refresh_token)}")
+        logger.debug("[Calendar] Token expired: %s, Has refresh token: %s", creds.expired, bool(creds.refresh_token))
         
-        # Always try to refresh if we have a refresh token (handles both expired and revoked tokens)
-        if creds.refresh_token:
+        # Both the token refresh and an uncached timezone lookup are network calls;
+        # when both are needed, look the timezone up while the token refreshes
+        needs_refresh = creds.refresh_token and _token_needs_refresh(creds)
+        timezone_future = None
+        if needs_refresh and current_user.location and current_user.location not in _LOCATION_TIMEZONES:
+            timezone_future = _TIMEZONE_EXECUTOR.submit(
+                _calendar_timezone, current_user.location, current_user.temperature_unit
+            )
+        
+        # Refresh only when the token has expired or is about to; a revoked grant that
+        # slips through surfaces below as RefreshError or an API 401, and both get the
+        # reconnect response
+        if needs_refresh:
             try:
-                from google.auth.transport.requests import Request
-                print(f"[Calendar] Attempting to refresh token for user {current_user.id}")
-                creds.refresh(Request())
+                logger.debug("[Calendar] Attempting to refresh token for user %s", current_user.id)
+                previous_token = creds.token
+                creds.refresh(_AUTH_REQUEST)
                 
                 # Update stored token with new credentials
-                credentials_dict = {
-                    'token': creds.token,
-                    'refresh_token': creds.refresh_token,
-                    'token_uri': creds.token_uri,
-                    'client_id': creds.client_id,
-                    'client_secret': creds.client_secret,
-                    'scopes': creds.scopes
-                }
-                current_user.google_token = json.dumps(credentials_dict)
-                current_user.google_refresh_token = creds.refresh_token
-                db.session.commit()
-                print(f"[Calendar] Token refreshed successfully for user {current_user.id}")
+                if creds.token != previous_token:
+                    _save_refreshed_credentials(current_user, creds)
+                logger.debug("[Calendar] Token refreshed successfully for user %s", current_user.id)
             except Exception as refresh_error:
-                print(f"[Calendar] Token refresh failed: {refresh_error}")
+                logger.warning("[Calendar] Token refresh failed: %s", refresh_error)
                 return jsonify({
                     'error': 'Your Google connection has expired. Please disconnect and reconnect your Google account.',
                     'reconnect_required': True
                 }), 401
         elif creds.expired:
-            print(f"[Calendar] Token expired but no refresh token available")
+            logger.warning("[Calendar] Token expired but no refresh token available")
             return jsonify({
                 'error': 'Your Google connection has expired and cannot be refreshed. Please disconnect and reconnect your Google account.',
                 'reconnect_required': True
             }), 401
         
-        # Build Calendar API service
-        try:
-            service = build('calendar', 'v3', credentials=creds)
-            print(f"[Calendar] Service built successfully for user {current_user.id}")
-        except Exception as e:
-            print(f"[Calendar] Service build failed: {e}")
-            return jsonify({'error': f'Failed to connect to Google Calendar API. Please reconnect your Google account. Error: {str(e)}'}), 500
-        
         # Get timezone from weather data (same as in generate_plan)
         # Note: We don't fetch calendar.get() because that requires calendar.readonly scope
         # The calendar.events scope only allows event operations, not calendar metadata
-        timezone = 'UTC'
-        if current_user.location:
-            temp_unit = current_user.temperature_unit or 'C'
-            weather_data = get_weather_forecast(current_user.location, temp_unit)
-            if weather_data:
-                timezone = weather_data.get('timezone', 'UTC')
-        print(f"[Calendar] Using timezone: {timezone}")
-        
-        tz = pytz.timezone(timezone)
-        events_created = 0
-        events_updated = 0
+        if timezone_future is not None:
+            timezone, tz = timezone_future.result()
+        else:
+            timezone, tz = _calendar_timezone(current_user.location, current_user.temperature_unit)
+        logger.debug("[Calendar] Using timezone: %s", timezone)
         
         # Check for existing events with our tag (exported from this app)
-        # We'll look for events in the date range of the plan
-        plan_dates = list(plan_data.keys())
-        if plan_dates:
-            first_date = datetime.strptime(min(plan_dates), '%Y-%m-%d')
-            last_date = datetime.strptime(max(plan_dates), '%Y-%m-%d') + timedelta(days=1)
-            
-            time_min = tz.localize(first_date).isoformat()
-            time_max = tz.localize(last_date).isoformat()
-            
-            print(f"[Calendar] Checking for existing tagged events between {time_min} and {time_max}")
-            
-            try:
-                existing_events_result = service.events().list(
-                    calendarId='primary',
-                    timeMin=time_min,
-                    timeMax=time_max,
-                    privateExtendedProperty='exportedFrom=aiActivityPlanner',
-                    singleEvents=True
-                ).execute()
-                
-                existing_tagged_events = existing_events_result.get('items', [])
-                print(f"[Calendar] Found {len(existing_tagged_events)} existing tagged events")
-                
-                # Build a map of existing events by date for conflict checking
-                existing_events_by_date = {}
-                for evt in existing_tagged_events:
-                    start = evt['start'].get('dateTime', evt['start'].get('date'))
-                    if 'dateTime' in evt['start']:
-                        evt_date = datetime.fromisoformat(start.replace('Z', '+00:00')).date().isoformat()
-                        existing_events_by_date[evt_date] = evt
-                
-                print(f"[Calendar] Existing events by date: {list(existing_events_by_date.keys())}")
-            except Exception as e:
-                print(f"[Calendar] Error checking existing events: {e}")
-                existing_events_by_date = {}
-        else:
-            existing_events_by_date = {}
+        # in the date range of the days being exported, reusing the conflict check's listing if it was just made
+        plan_context = None
+        existing_events_by_date = {}
+        try:
+            plan_context = _load_plan_context(current_user, service, tz, plan_days)
+            existing_events_by_date = plan_context['events_by_date']
+            logger.debug("[Calendar] Existing events by date: %s", list(existing_events_by_date))
+        except Exception as e:
+            if _is_calendar_auth_error(e):
+                raise
+            logger.warning("[Calendar] Error checking existing events: %s", e)
         
-        print(f"[Calendar] Processing plan with {len(plan_data)} days")
-        print(f"[Calendar] Plan keys: {list(plan_data.keys())}")
+        logger.debug("[Calendar] Processing plan with %s exportable days", len(plan_days))
         
-        # Create events for each day in the plan
-        for date_key, day_data in plan_data.items():
+        # Tag every event with one export stamp; the client serializes each body when the
+        # request is built, so the events can share this dict
+        export_tag = {
+            'exportedFrom': 'aiActivityPlanner',
+            'exportedAt': datetime.utcnow().isoformat()
+        }
+        
+        # Build an insert or update for each day in the plan; they are sent in batches below
+        calendar_requests = []
+        for date_key, day_data in plan_days.items():
             try:
-                print(f"[Calendar] Processing day: {date_key}, data: {day_data}")
+                logger.debug("[Calendar] Processing day %s data=%s", date_key, day_data)
                 # Parse the date
-                event_date = datetime.strptime(date_key, '%Y-%m-%d').date()
+                event_date = date.fromisoformat(date_key)
                 activity = day_data.get('activity', '')
                 
-                print(f"[Calendar] Activity for {date_key}: '{activity}'")
-                
-                # Skip rest days
-                if 'rest' in activity.lower():
-                    print(f"[Calendar] Skipping rest day: {date_key}")
-                    continue
+                logger.debug("[Calendar] Activity for %s: %r", date_key, activity)
                 
                 # Get time and duration from plan, or use defaults
                 activity_time = day_data.get('time', '09:00')
@@ -1030,13 +1329,12 @@ def export_to_google_calendar():
                     # Default to 9 AM if time parsing fails
                     start_datetime = datetime.combine(event_date, datetime.min.time().replace(hour=9))
                 
-                # Calculate end time based on duration
-                end_datetime = start_datetime + timedelta(minutes=duration_minutes)
-                print(f"[Calendar] Event time: {activity_time}, duration: {duration_minutes} min")
+                logger.debug("[Calendar] Event time: %s, duration: %s min", activity_time, duration_minutes)
                 
-                # Localize to user's timezone
+                # Localize to user's timezone; normalize fixes the end's offset when the
+                # event spans a DST transition
                 start_datetime = tz.localize(start_datetime)
-                end_datetime = tz.localize(end_datetime)
+                end_datetime = tz.normalize(start_datetime + timedelta(minutes=duration_minutes))
                 
                 # Build event description
                 description = day_data.get('notes', '')
@@ -1056,12 +1354,7 @@ def export_to_google_calendar():
                         'timeZone': timezone,
                     },
                     'colorId': '9',  # Blue color for activities
-                    'extendedProperties': {
-                        'private': {
-                            'exportedFrom': 'aiActivityPlanner',
-                            'exportedAt': datetime.utcnow().isoformat()
-                        }
-                    }
+                    'extendedProperties': {'private': export_tag}
                 }
                 
                 # Check if we have an existing event for this date
@@ -1069,24 +1362,49 @@ def export_to_google_calendar():
                     # Update the existing event instead of creating a new one
                     existing_event = existing_events_by_date[date_key]
                     event_id = existing_event['id']
-                    print(f"[Calendar] Updating existing event {event_id} for {date_key}")
-                    service.events().update(calendarId='primary', eventId=event_id, body=event).execute()
-                    events_updated += 1
-                    print(f"[Calendar] Updated event for {date_key}: {activity}")
+                    logger.debug("[Calendar] Updating existing event %s for %s", event_id, date_key)
+                    calendar_requests.append((
+                        f'updated:{date_key}',
+                        service.events().update(calendarId='primary', eventId=event_id, body=event)
+                    ))
                 else:
                     # Create new event
-                    service.events().insert(calendarId='primary', body=event).execute()
-                    events_created += 1
-                    print(f"[Calendar] Created event for {date_key}: {activity}")
+                    calendar_requests.append((
+                        f'created:{date_key}',
+                        service.events().insert(calendarId='primary', body=event)
+                    ))
                 
             except Exception as e:
-                print(f"[Calendar] Error creating event for {date_key}: {e}")
+                logger.warning("[Calendar] Error creating event for %s: %s", date_key, e)
                 continue
         
-        print(f"[Calendar] Total events created: {events_created}, updated: {events_updated}")
+        # Send the inserts/updates as batch requests instead of one round-trip per day
+        export_counts = {'created': 0, 'updated': 0}
+        
+        def _on_event_exported(request_id, response):
+            action, date_key = request_id.split(':', 1)
+            export_counts[action] += 1
+            logger.debug("[Calendar] %s event for %s: %s", action.capitalize(), date_key, response.get('summary'))
+        
+        failures = _execute_calendar_requests(service, calendar_requests, _on_event_exported)
+        for request_id, exception in failures.items():
+            logger.warning("[Calendar] Error exporting event for %s: %s", request_id.split(':', 1)[1], exception)
+        
+        events_created = export_counts['created']
+        events_updated = export_counts['updated']
+        
+        # Every write was rejected for auth; report it as a lost connection, not an empty plan
+        auth_failure = next((e for e in failures.values() if _is_calendar_auth_error(e)), None)
+        if auth_failure is not None and not events_created and not events_updated:
+            raise auth_failure
+        
+        # The listing no longer matches the calendar
+        if plan_context is not None:
+            _forget_existing_events(plan_context['cache_key'])
+        logger.info("[Calendar] Total events created: %s, updated: %s", events_created, events_updated)
         
         if events_created == 0 and events_updated == 0:
-            print("[Calendar] No events created or updated - returning error")
+            logger.info("[Calendar] No events created or updated - returning error")
             return jsonify({
                 'success': False,
                 'message': 'No events were created. Your plan may only contain rest days.'
@@ -1108,12 +1426,20 @@ def export_to_google_calendar():
             'updated': events_updated
         })
         
+    except RefreshError:
+        return jsonify({
+            'error': 'Your Google connection has expired. Please disconnect and reconnect your Google account.',
+            'reconnect_required': True
+        }), 401
     except HttpError as e:
+        if e.resp.status == 401:
+            return jsonify({
+                'error': 'Your Google connection has expired. Please disconnect and reconnect your Google account.',
+                'reconnect_required': True
+            }), 401
         if e.resp.status == 403:
             return jsonify({'error': 'Calendar access denied. Please disconnect and reconnect your Google account to grant calendar permissions.'}), 403
         return jsonify({'error': f'Google Calendar API error: {str(e)}'}), 500
     except Exception as e:
-        import traceback
-        print(f"Export error: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("[Calendar] Export error for user %s", current_user.id)
         return jsonify({'error': f'Failed to export to calendar: {str(e)}. Please try reconnecting your Google account.'}), 500
@@ -1,14 +1,24 @@
 """
 Utility functions for weather forecasting, geolocation, and external APIs.
 """
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import quote
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 import requests
 
 REQUEST_TIMEOUT = 5
 
+# Weather forecasts keyed by (location, unit): {key: (expires_at, forecast)}
+WEATHER_CACHE_TTL = 600
+_WEATHER_CACHE_MAX = 1024
+_weather_cache: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+_weather_cache_lock = threading.RLock()
+
 
 def get_location_from_ip() -> Optional[str]:
     """
@@ -28,6 +38,9 @@ def search_cities(query: str) -> List[Dict[str, Any]]:
     """
     Search for cities matching query using Open-Meteo geocoding API.
 
+    Results are cached per case-insensitive query, since autocomplete
+    repeats the same prefixes constantly.
+
     Args:
         query: City name to search for.
 
@@ -35,37 +48,115 @@ def search_cities(query: str) -> List[Dict[str, Any]]:
         List of city dicts with name, display, latitude, longitude.
     """
     try:
-        encoded_query = quote(query)
-        url = f"https://geocoding-api.open-meteo.com/v1/search?name={encoded_query}&count=10&language=en&format=json"
-        response = requests.get(url, timeout=REQUEST_TIMEOUT)
-        data = response.json()
-
-        if not data.get('results'):
-            return []
-
-        cities = []
-        for result in data['results']:
-            city_name = result.get('name', '')
-            admin1 = result.get('admin1', '')
-            country = result.get('country', '')
-
-            display_parts = [city_name]
-            if admin1:
-                display_parts.append(admin1)
-            display_parts.append(country)
-
-            cities.append({
-                'name': city_name,
-                'display': ', '.join(display_parts),
-                'latitude': result.get('latitude'),
-                'longitude': result.get('longitude'),
-            })
-        return cities
+        return list(_search_cities_cached(query.strip().lower()))
     except Exception:
         return []
 
 
+@lru_cache(maxsize=4096)
+def _search_cities_cached(query: str) -> Tuple[Dict[str, Any], ...]:
+    """Fetch geocoding matches for a normalized query; errors propagate so they aren't cached."""
+    encoded_query = quote(query)
+    url = f"https://geocoding-api.open-meteo.com/v1/search?name={encoded_query}&count=10&language=en&format=json"
+    response = requests.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+
+    cities = []
+    for result in data.get('results') or ():
+        city_name = result.get('name', '')
+        admin1 = result.get('admin1', '')
+        country = result.get('country', '')
+
+        display_parts = [city_name]
+        if admin1:
+            display_parts.append(admin1)
+        display_parts.append(country)
+
+        cities.append({
+            'name': city_name,
+            'display': ', '.join(display_parts),
+            'latitude': result.get('latitude'),
+            'longitude': result.get('longitude'),
+        })
+    return tuple(cities)
+
+
 def get_weather_forecast(location: str, unit: str = 'C') -> Optional[Dict[str, Any]]:
+    """
+    Get the 7-day weather forecast, reusing a fetch from the last few minutes.
+
+    The returned dict is shared between callers and must not be mutated.
+
+    Args:
+        location: City name or location string.
+        unit: Temperature unit ('C' for Celsius, 'F' for Fahrenheit).
+
+    Returns:
+        Dict with forecast data and timezone, or None on error.
+    """
+    key = (location, unit)
+    now = time.monotonic()
+    with _weather_cache_lock:
+        cached = _weather_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    weather = _fetch_weather_forecast(location, unit)
+    if weather is not None:
+        with _weather_cache_lock:
+            if len(_weather_cache) >= _WEATHER_CACHE_MAX:
+                _weather_cache.clear()
+            _weather_cache[key] = (now + WEATHER_CACHE_TTL, weather)
+    return weather
+
+
+@lru_cache(maxsize=256)
+def _load_zone(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
+
+def get_zone(name: str) -> Optional[ZoneInfo]:
+    """
+    Resolve an IANA timezone name, reusing previously loaded zones.
+
+    Returns:
+        ZoneInfo for the name, or None if it is unknown.
+    """
+    try:
+        return _load_zone(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def get_planning_context(user) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str], datetime, str]:
+    """
+    Gather the weather and local time used to plan for a user.
+
+    Args:
+        user: User whose location and temperature unit apply.
+
+    Returns:
+        Tuple of (weather_forecast, timezone, now, temp_unit). The forecast and
+        timezone are None when the user has no location or the fetch fails;
+        now is in the location's timezone when it is known.
+    """
+    temp_unit = user.temperature_unit or 'C'
+    weather_forecast = None
+    location_timezone = None
+    if user.location:
+        weather_data = get_weather_forecast(user.location, temp_unit)
+        if weather_data:
+            weather_forecast = weather_data.get('forecast')
+            location_timezone = weather_data.get('timezone')
+
+    tz = get_zone(location_timezone) if location_timezone else None
+    now = datetime.now(tz) if tz else datetime.now()
+
+    return weather_forecast, location_timezone, now, temp_unit
+
+
+def _fetch_weather_forecast(location: str, unit: str = 'C') -> Optional[Dict[str, Any]]:
     """
     Fetch 7-day weather forecast using Open-Meteo API.
 
@@ -0,0 +1,55 @@
+"""
+In-process rate limiting for flood-prone endpoints.
+
+Counters live in the worker's memory, so limits apply per instance. That is
+enough to shed floods before they reach the database or third-party APIs
+without adding a shared store.
+"""
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Tuple
+
+from flask import jsonify
+
+_MAX_TRACKED_KEYS = 10000
+
+
+def rate_limit(limit: int, period: float, key_func: Callable[[], str]) -> Callable:
+    """
+    Reject requests over `limit` per `period` seconds for the same key with a 429.
+
+    Args:
+        limit: Requests allowed per window.
+        period: Window length in seconds.
+        key_func: Returns the bucket key for the current request.
+
+    Returns:
+        View decorator.
+    """
+    windows: Dict[str, Tuple[float, int]] = {}
+    lock = threading.Lock()
+
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            key = key_func()
+            now = time.monotonic()
+            with lock:
+                start, count = windows.get(key, (now, 0))
+                if now - start >= period:
+                    start, count = now, 0
+                allowed = count < limit
+                if allowed:
+                    if len(windows) >= _MAX_TRACKED_KEYS:
+                        windows.clear()
+                    windows[key] = (start, count + 1)
+
+            if not allowed:
+                response = jsonify({'error': 'Too many requests. Please slow down.'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(int(start + period - now) + 1)
+                return response
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
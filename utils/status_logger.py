@@ -44,6 +44,7 @@ def log_status_change(
     old_value: Any = None,
     new_value: Any = None,
     changed_by_user_id: Optional[int] = None,
+    commit: bool = True,
 ) -> Optional[StatusChange]:
     """
     Log a status change event for a user.
@@ -55,6 +56,8 @@ def log_status_change(
         old_value: Previous value (optional)
         new_value: New value (optional)
         changed_by_user_id: Admin user ID who made the change (optional)
+        commit: Commit immediately; pass False to add the row to the caller's
+            transaction so it is committed together with the change it records
 
     Returns:
         StatusChange object if successful, None otherwise
@@ -78,12 +81,14 @@ def log_status_change(
         )
         
         db.session.add(status_change)
-        db.session.commit()
+        if commit:
+            db.session.commit()
         
         return status_change
     except Exception as e:
         print(f"Error logging status change: {e}")
-        db.session.rollback()
+        if commit:
+            db.session.rollback()
         return None
 
 
@@ -102,9 +107,10 @@ def log_email_changed(user_id, old_email, new_email, source='user_action', chang
     return log_status_change(user_id, 'email_changed', source, old_email, new_email, changed_by_user_id=changed_by_user_id)
 
 
-def log_subscription_changed(user_id, old_tier, new_tier, source='user_action', changed_by_user_id=None):
+def log_subscription_changed(user_id, old_tier, new_tier, source='user_action', changed_by_user_id=None, commit=True):
     """Log when a user's subscription tier is changed."""
-    return log_status_change(user_id, 'subscription_tier_changed', source, old_tier, new_tier, changed_by_user_id=changed_by_user_id)
+    return log_status_change(user_id, 'subscription_tier_changed', source, old_tier, new_tier,
+                             changed_by_user_id=changed_by_user_id, commit=commit)
 
 
 def log_test_flag_changed(user_id, old_value, new_value, source='admin_action', changed_by_user_id=None):